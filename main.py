@@ -1,24 +1,38 @@
 import io
 import tarfile
+import collections
 import logging
 import os
 import uuid
 import docker
+import socket
+import select
+import stat
+import struct
 import threading
 import time
 import asyncio
-import string
 import secrets
-from fastapi import FastAPI, HTTPException, Security, UploadFile, File, Form, Query, BackgroundTasks, Request
+import hmac
+import base64
+import codecs
+import json
+import anyio
+from concurrent.futures import ThreadPoolExecutor
+from docker.models.containers import ExecResult
+from docker.utils.socket import frames_iter, demux_adaptor, consume_socket_output, next_frame_header, read_exactly, STDOUT
+from fastapi import FastAPI, HTTPException, Security, UploadFile, File, Form, Query, Request
 from fastapi.security import APIKeyHeader
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
 import mimetypes
-import tempfile
+import functools
 from urllib.parse import quote
 from pydantic import BaseModel, ConfigDict
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple, BinaryIO, Literal
 import shutil
 import ast
+import re
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -26,6 +40,7 @@ logger = logging.getLogger(__name__)
 
 # Configuration
 API_KEY = os.environ.get("LIBRECHAT_CODE_API_KEY", "your_secret_key")
+API_KEY_BYTES = API_KEY.encode("utf-8")
 # RCE_DATA_DIR_HOST is the path on the Docker Host (used for mounting)
 _raw_data_dir = os.environ.get("RCE_DATA_DIR_HOST", os.environ.get("RCE_DATA_DIR", ""))
 # RCE_DATA_DIR_INTERNAL is the path inside this API container (used for writing files)
@@ -58,7 +73,24 @@ if RCE_DATA_DIR_HOST:
 
 RCE_SESSION_TTL = int(os.environ.get("RCE_SESSION_TTL", "3600"))
 RCE_MAX_SESSIONS = int(os.environ.get("RCE_MAX_SESSIONS", "100"))
+# At RCE_MAX_SESSIONS, the least recently used session is evicted if idle for at least this many seconds
+RCE_EVICT_MIN_IDLE = int(os.environ.get("RCE_EVICT_MIN_IDLE", "60"))
+# Pause ('docker pause') session containers idle for this many seconds, unpausing on next use (0 disables)
+RCE_SESSION_PAUSE_AFTER = int(os.environ.get("RCE_SESSION_PAUSE_AFTER", "0"))
 RCE_MANAGED_BY_VALUE = "librechat-rce"
+# Number of idle, pre-started containers kept ready for new sessions (0 disables the pool)
+RCE_WARM_POOL_SIZE = int(os.environ.get("RCE_WARM_POOL_SIZE", "2"))
+RCE_WARM_POOL_INTERVAL = int(os.environ.get("RCE_WARM_POOL_INTERVAL", "5"))
+# Freeze idle pooled containers with 'docker pause' and thaw them when a session claims one
+RCE_WARM_POOL_PAUSE = os.environ.get("RCE_WARM_POOL_PAUSE", "false").lower() == "true"
+# List the workspace after every /exec so generated files are returned to LibreChat
+RCE_LIST_FILES_ON_EXEC = os.environ.get("RCE_LIST_FILES_ON_EXEC", "true").lower() == "true"
+# Run code in a long-lived interpreter per session instead of starting 'python3' for every /exec
+RCE_PYTHON_WORKER = os.environ.get("RCE_PYTHON_WORKER", "true").lower() == "true"
+# With output_format "auto" (opt-in), stdout/stderr larger than this many bytes are returned base64-encoded
+RCE_TEXT_OUTPUT_LIMIT = int(os.environ.get("RCE_TEXT_OUTPUT_LIMIT", str(1 << 20)))
+# Threads for blocking Docker calls; each running /exec holds one for its whole duration
+RCE_THREAD_POOL_SIZE = int(os.environ.get("RCE_THREAD_POOL_SIZE", str(max(32, RCE_MAX_SESSIONS))))
 
 # 1. Authentication Scheme
 # Use auto_error=False to allow fallback to query parameter
@@ -69,15 +101,69 @@ async def get_api_key(
     api_key_q: Optional[str] = Query(None, alias="api_key")
 ):
     key = api_key_h or api_key_q
-    if key != API_KEY:
+    # Constant-time comparison so response timing does not reveal how much of the key matched
+    if key is None or not hmac.compare_digest(key.encode("utf-8"), API_KEY_BYTES):
         raise HTTPException(status_code=401, detail="Invalid API Key")
     return key
 
+# Snippets up to this many characters are memoized; re-runs and retries then skip parsing
+# entirely. With 512 entries, source plus wrapped copy stay around 4 MiB for ASCII code.
+_WRAP_CACHE_MAX_CODE = 4 * 1024
+
 def wrap_code(code: str) -> str:
     """
     Wraps the last expression in print(repr(...)) if it's an expression.
     This mimics Jupyter/Notebook behavior where the last expression is automatically displayed.
     """
+    if len(code) <= _WRAP_CACHE_MAX_CODE:
+        return _wrap_code_cached(code)
+    return _wrap_code(code)
+
+@functools.lru_cache(maxsize=512)
+def _wrap_code_cached(code: str) -> str:
+    return _wrap_code(code)
+
+_LINE_BREAK = re.compile(r"\r\n|\r|\n")
+_DISPLAY_LAST_RESULT = "\nif __last_res__ is not None: print(repr(__last_res__))\n"
+
+def _source_offset(code: str, line_starts: List[int], lineno: int, col_offset: int) -> int:
+    """Converts an AST position (1-based line, UTF-8 byte column) to an index into code."""
+    line_start = line_starts[lineno - 1]
+    line = code[line_start:line_start + col_offset]
+    if line.isascii():
+        return line_start + col_offset
+    return line_start + len(code[line_start:].encode("utf-8")[:col_offset].decode("utf-8"))
+
+# Statements a line can only start with at statement level, never inside an expression
+_STATEMENT_LINE = re.compile(
+    r"\s*(?:import|from|def|class|return|pass|raise|del|global|nonlocal|assert|break|continue|while|try|with)\b"
+)
+
+def _ends_with_statement(code: str) -> bool:
+    """
+    Cheap textual check: True when the last line is plainly not part of an expression statement,
+    so parsing can be skipped. Anything ambiguous (multi-line strings, semicolons, continuations)
+    returns False and goes through the parser.
+    """
+    if '"""' in code or "'''" in code:
+        return False
+    # The last two significant lines. Split on Python's own line breaks only: str.splitlines
+    # also splits on form feeds and Unicode separators, which may sit inside string literals.
+    last = previous = None
+    for line in reversed(_LINE_BREAK.split(code)):
+        if line.strip() and not line.lstrip().startswith("#"):
+            if last is None:
+                last = line
+            else:
+                previous = line
+                break
+    if last is None or ";" in last or (previous is not None and previous.rstrip().endswith("\\")):
+        return False
+    return _STATEMENT_LINE.match(last) is not None
+
+def _wrap_code(code: str) -> str:
+    if _ends_with_statement(code):
+        return code
     try:
         tree = ast.parse(code)
         if not tree.body:
@@ -85,46 +171,14 @@ def wrap_code(code: str) -> str:
 
         last_node = tree.body[-1]
         if isinstance(last_node, ast.Expr):
-            # Wrap the expression in:
-            # __last_res__ = <expression>
-            # if __last_res__ is not None: print(repr(__last_res__))
-            # This mimics Jupyter/Notebook behavior.
-
-            # Create: __last_res__ = <last_node.value>
-            assign_node = ast.Assign(
-                targets=[ast.Name(id='__last_res__', ctx=ast.Store())],
-                value=last_node.value
-            )
-
-            # Create: if __last_res__ is not None: print(repr(__last_res__))
-            if_node = ast.If(
-                test=ast.Compare(
-                    left=ast.Name(id='__last_res__', ctx=ast.Load()),
-                    ops=[ast.IsNot()],
-                    comparators=[ast.Constant(value=None)]
-                ),
-                body=[
-                    ast.Expr(
-                        value=ast.Call(
-                            func=ast.Name(id='print', ctx=ast.Load()),
-                            args=[
-                                ast.Call(
-                                    func=ast.Name(id='repr', ctx=ast.Load()),
-                                    args=[ast.Name(id='__last_res__', ctx=ast.Load())],
-                                    keywords=[]
-                                )
-                            ],
-                            keywords=[]
-                        )
-                    )
-                ],
-                orelse=[]
-            )
-
-            tree.body[-1] = assign_node
-            tree.body.append(if_node)
-            ast.fix_missing_locations(tree)
-            return ast.unparse(tree)
+            # Splice the source instead of unparsing the whole tree:
+            #   <code before the expression>__last_res__ = <expression><rest of its line>
+            #   if __last_res__ is not None: print(repr(__last_res__))
+            # This mimics Jupyter/Notebook behavior, and keeps the user's formatting,
+            # comments and line numbers (so tracebacks point at the right lines).
+            line_starts = [0] + [m.end() for m in _LINE_BREAK.finditer(code)]
+            start = _source_offset(code, line_starts, last_node.lineno, last_node.col_offset)
+            return code[:start] + "__last_res__ = " + code[start:] + _DISPLAY_LAST_RESULT
     except Exception:
         # If parsing fails (e.g. syntax error), return original code and let it fail during execution
         return code
@@ -143,13 +197,19 @@ async def add_security_headers(request, call_next):
     response.headers["Referrer-Policy"] = "no-referrer"
     return response
 
-DOCKER_CLIENT = docker.from_env()
+# docker-py keeps only 10 pooled daemon connections by default; beyond that, concurrent
+# calls from the thread pool open and discard a new connection each time
+DOCKER_CLIENT = docker.from_env(max_pool_size=RCE_THREAD_POOL_SIZE)
 RCE_IMAGE_NAME = os.environ.get("RCE_IMAGE_NAME", "custom-rce-kernel:latest")
 
 # Nanoid-compatible ID generation (21 chars, [A-Za-z0-9_-])
-_NANOID_ALPHABET = string.ascii_letters + string.digits + '_-'
 def generate_nanoid(size: int = 21) -> str:
-    return ''.join(secrets.choice(_NANOID_ALPHABET) for _ in range(size))
+    # The URL-safe base64 alphabet is the nanoid alphabet; each output character
+    # carries 6 random bits, so ceil(size * 6 / 8) bytes cover the whole ID.
+    return secrets.token_urlsafe((size * 3 + 3) // 4)[:size]
+
+# \w is exactly str.isalnum() plus '_', so this keeps the same (Unicode) characters
+_UNSAFE_ID_CHARS = re.compile(r"[^\w-]")
 
 def sanitize_id(id_str: str) -> str:
     """Sanitizes an ID to allow only alphanumeric, hyphen, and underscore."""
@@ -157,7 +217,252 @@ def sanitize_id(id_str: str) -> str:
         return ""
     # Remove any characters that are not alphanumeric, hyphen, or underscore
     # This prevents path traversal and other injection attacks.
-    return "".join(c for c in id_str if c.isalnum() or c in ('-', '_'))
+    return _UNSAFE_ID_CHARS.sub("", id_str)
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+class _ChunkStream(io.RawIOBase):
+    """Read-only file object over an iterator of byte chunks, such as a get_archive stream."""
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            try:
+                self._buffer = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+def _iter_file(f, *closables):
+    """Yields a file object in STREAM_CHUNK_SIZE pieces and closes it (and closables) when done."""
+    try:
+        while chunk := f.read(STREAM_CHUNK_SIZE):
+            yield chunk
+    finally:
+        f.close()
+        for c in closables:
+            c.close()
+
+# ustar header of a regular file as TarInfo builds it (mode 644, mtime 0), with the name
+# cleared and the checksum field blanked to spaces, as the checksum is computed over it
+_TAR_HEADER_TEMPLATE = bytearray(tarfile.TarInfo(name="x").tobuf(format=tarfile.USTAR_FORMAT))
+_TAR_HEADER_TEMPLATE[0:100] = tarfile.NUL * 100
+_TAR_HEADER_TEMPLATE[148:156] = b" " * 8
+
+def _tar_header(name: str, size: int) -> bytes:
+    """
+    Returns the header TarInfo(name).tobuf() would build for a regular file, filling in a
+    prebuilt ustar template for the common short ASCII name instead of running tarfile.
+    """
+    if len(name) > 100 or not name.isascii() or size > 0o77777777777:
+        # Needs a PAX extended header
+        tar_info = tarfile.TarInfo(name=name)
+        tar_info.size = size
+        return tar_info.tobuf()
+    header = _TAR_HEADER_TEMPLATE.copy()
+    header[0:len(name)] = name.encode("ascii")
+    header[124:136] = b"%011o\0" % size
+    header[148:156] = b"%06o\0 " % sum(header)
+    return bytes(header)
+
+def _iter_tar(files: List[Tuple[str, BinaryIO]]):
+    """
+    Yields a tar archive of (name, file object) entries piece by piece, so put_archive can
+    stream it to the daemon without the archive or the file contents being held in memory.
+    """
+    for name, fileobj in files:
+        size = fileobj.seek(0, os.SEEK_END)
+        fileobj.seek(0)
+        yield _tar_header(name, size)
+
+        remaining = size
+        while remaining > 0:
+            chunk = fileobj.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                raise OSError(f"Unexpected end of data in {name}")
+            yield chunk
+            remaining -= len(chunk)
+
+        padding = -size % tarfile.BLOCKSIZE
+        if padding:
+            yield tarfile.NUL * padding
+    # End-of-archive marker: two zero blocks
+    yield tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+
+# Source of the long-lived interpreter started in each sandbox with 'python3 -u -c'.
+# Cells arrive on stdin as <bool list files><u32 length><utf-8 source>. Each runs in a fresh
+# __main__ module with fds 1/2 redirected to temp files, and the reply written to the original
+# stdout is <u8 exit code><u32 stdout length><u32 stderr length><u32 listing length><stdout>
+# <stderr><listing>, the listing being the workspace's file names NUL-separated, if requested.
+# After each cell the worker does what interpreter shutdown would (joins non-daemon threads,
+# runs atexit handlers) and resets os.environ, sys.path, sys.argv and pyplot figures. Imported
+# modules stay loaded, so other module-level state in libraries does carry over.
+_WORKER_SOURCE = r'''
+import atexit, os, struct, sys, tempfile, traceback, types
+proto_in = os.fdopen(os.dup(0), "rb")
+proto_out = os.fdopen(os.dup(1), "wb")
+os.dup2(os.open(os.devnull, os.O_RDONLY), 0)
+out = tempfile.TemporaryFile(buffering=0)
+err = tempfile.TemporaryFile(buffering=0)
+workdir = os.getcwd()
+environ = dict(os.environ)
+path = list(sys.path)
+while True:
+    header = proto_in.read(5)
+    if len(header) < 5:
+        break
+    want_files, size = struct.unpack(">?I", header)
+    source = proto_in.read(size)
+    for f in (out, err):
+        f.seek(0)
+        f.truncate()
+    os.dup2(out.fileno(), 1)
+    os.dup2(err.fileno(), 2)
+    sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+    sys.argv = ["-"]
+    module = types.ModuleType("__main__")
+    sys.modules["__main__"] = module
+    exit_code = 0
+    try:
+        os.chdir(workdir)
+        exec(compile(source, "<stdin>", "exec"), module.__dict__)
+    except SystemExit as e:
+        if isinstance(e.code, int):
+            exit_code = e.code
+        elif e.code is not None:
+            print(e.code, file=sys.__stderr__)
+            exit_code = 1
+    except BaseException:
+        exit_code = 1
+        etype, value, tb = sys.exc_info()
+        traceback.print_exception(etype, value, tb.tb_next)
+    threading = sys.modules.get("threading")
+    if threading is not None:
+        for thread in threading.enumerate():
+            if thread is not threading.main_thread() and not thread.daemon:
+                thread.join()
+    atexit._run_exitfuncs()
+    pyplot = sys.modules.get("matplotlib.pyplot")
+    if pyplot is not None:
+        try:
+            pyplot.close("all")
+        except Exception:
+            pass
+    os.environ.clear()
+    os.environ.update(environ)
+    sys.path[:] = path
+    for stream in (sys.stdout, sys.stderr, sys.__stdout__, sys.__stderr__):
+        try:
+            stream.flush()
+        except Exception:
+            pass
+    out.seek(0)
+    err.seek(0)
+    stdout, stderr = out.read(), err.read()
+    files = b""
+    if want_files:
+        try:
+            with os.scandir(workdir) as entries:
+                names = [e.name for e in entries if e.is_file(follow_symlinks=False)]
+            files = "\0".join(names).encode("utf-8", "surrogateescape")
+        except OSError:
+            pass
+    proto_out.write(
+        struct.pack(">BIII", exit_code & 0xFF, len(stdout), len(stderr), len(files)) + stdout + stderr + files
+    )
+    proto_out.flush()
+'''
+
+class _PythonWorker:
+    """
+    Client for a _WORKER_SOURCE interpreter running in a sandbox via 'docker exec'.
+    Reusing it skips the interpreter start-up a fresh 'python3 -' pays on every run.
+    """
+    def __init__(self, container):
+        api = container.client.api
+        self.exec_id = api.exec_create(
+            container.id,
+            cmd=["python3", "-u", "-c", _WORKER_SOURCE],
+            stdin=True,
+            workdir="/mnt/data"
+        )["Id"]
+        self.sock = api.exec_start(self.exec_id, socket=True)
+        self.raw_sock = getattr(self.sock, "_sock", self.sock)
+        self.lock = threading.Lock()
+        self._buffer = bytearray()
+
+    def is_alive(self) -> bool:
+        # An idle worker never writes, so a readable socket means the exec (or container) ended
+        try:
+            readable, _, _ = select.select([self.raw_sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+    def run(self, code_content: str, list_files: bool = False) -> Tuple[ExecResult, Optional[List[str]]]:
+        """
+        Runs one cell. Returns its ExecResult and, if list_files is set, the workspace
+        file names as of the end of the run (saving a separate listing exec), else None.
+        """
+        payload = code_content.encode("utf-8")
+        self.raw_sock.sendall(struct.pack(">?I", list_files, len(payload)) + payload)
+        exit_code, stdout_len, stderr_len, files_len = struct.unpack(">BIII", self._read(13))
+        stdout = self._read(stdout_len)
+        stderr = self._read(stderr_len)
+        files = self._read(files_len)
+        file_names = [f for f in files.decode("utf-8", errors="replace").split("\0") if f] if list_files else None
+        return ExecResult(exit_code, (stdout or None, stderr or None)), file_names
+
+    def _read(self, n: int) -> bytes:
+        """Reads n bytes of the worker's stdout from the multiplexed exec stream."""
+        while len(self._buffer) < n:
+            stream, size = next_frame_header(self.sock)
+            if size < 0:
+                raise ConnectionError("Python worker exited")
+            data = read_exactly(self.sock, size)
+            if stream == STDOUT:
+                self._buffer += data
+        data = bytes(self._buffer[:n])
+        del self._buffer[:n]
+        return data
+
+    def close(self):
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+
+def format_output(name: str, data: Optional[bytes], output_format: str = "text") -> Dict[str, str]:
+    """
+    Formats a captured stream for the response. Text is decoded in one pass with invalid
+    bytes replaced; "bytes" (or "auto" above RCE_TEXT_OUTPUT_LIMIT) skips decoding and
+    returns the raw output base64-encoded under '<name>_b64'.
+    """
+    if not data:
+        return {name: ""}
+    if output_format == "bytes" or (output_format == "auto" and len(data) > RCE_TEXT_OUTPUT_LIMIT):
+        return {name: "", f"{name}_b64": base64.b64encode(data).decode("ascii")}
+    return {name: data.decode("utf-8", errors="replace")}
+
+# Load the system MIME tables once at start-up instead of on the first lookup
+mimetypes.init()
+
+@functools.lru_cache(maxsize=256)
+def _mime_for_suffix(suffix: str) -> str:
+    return mimetypes.guess_type(f"x{suffix}")[0] or "application/octet-stream"
+
+def guess_mime_type(filename: str) -> str:
+    """mimetypes.guess_type, cached per suffix (e.g. '.csv', '.tar.gz'), with an octet-stream default."""
+    dot = filename.find(".")
+    return _mime_for_suffix(filename[dot:] if dot != -1 else "")
 
 # 2. Kernel Manager for Session Management
 class KernelManager:
@@ -172,6 +477,19 @@ class KernelManager:
         self.nanoid_to_session: Dict[str, str] = {}
         self.session_to_nanoid: Dict[str, str] = {}
         self.file_id_map: Dict[str, Dict[str, str]] = {}  # {nanoid_session_id: {nanoid_file_id: filename}}
+        self.file_name_to_id: Dict[str, Dict[str, str]] = {}  # Inverse of file_id_map: {nanoid_session_id: {filename: nanoid_file_id}}
+        # Pre-started containers not yet bound to a session: deque of (pool_id, container)
+        self.warm_pool = collections.deque()
+        # Per-session locks serializing container creation/refresh, and the
+        # number of containers currently being started (counted against the cap)
+        self.session_locks: Dict[str, threading.Lock] = {}
+        self._starting = 0
+        # Long-lived Python workers: container id -> _PythonWorker
+        self.workers: Dict[str, _PythonWorker] = {}
+        # Number of running /exec calls per session; such sessions are never evicted
+        self.in_flight: Dict[str, int] = {}
+        # Sessions that had ID mappings or a lock but no container at the last cleanup
+        self._orphaned_sessions = set()
 
     def resolve_session_id(self, session_id: str) -> str:
         """Resolves a potential nanoid session ID to the real internal session ID."""
@@ -179,59 +497,111 @@ class KernelManager:
         with self.lock:
             return self.nanoid_to_session.get(sanitized_id, sanitized_id)
 
-    def get_or_create_container(self, session_id: str, force_refresh: bool = False):
+    def _session_lock(self, session_id: str) -> threading.Lock:
+        """Returns the lock serializing container lifecycle changes for one session."""
         with self.lock:
-            if not force_refresh and session_id in self.active_kernels:
-                self.active_kernels[session_id]["last_accessed"] = time.time()
-                return self.active_kernels[session_id]["container"]
+            lock = self.session_locks.get(session_id)
+            if lock is None:
+                lock = self.session_locks[session_id] = threading.Lock()
+            return lock
 
-            if session_id in self.active_kernels:
+    def get_or_create_container(self, session_id: str, force_refresh: bool = False):
+        # Fast path without locking: dict.get and the timestamp store are atomic,
+        # and cleanup re-checks last_accessed under the lock before evicting.
+        data = None if force_refresh else self.active_kernels.get(session_id)
+        if data and not data.get("paused"):
+            data["last_accessed"] = time.time()
+            return data["container"]
+
+        # Slow path: serialize per session so concurrent requests for the same
+        # session don't race on reload/start, while other sessions proceed.
+        with self._session_lock(session_id):
+            with self.lock:
+                data = self.active_kernels.get(session_id)
+                if data and not force_refresh and not data.get("paused"):
+                    # Another request created it while we were waiting
+                    data["last_accessed"] = time.time()
+                    return data["container"]
+
+            if data:
+                container = data["container"]
                 try:
-                    # Re-fetch or refresh container status
-                    container = self.active_kernels[session_id]["container"]
-                    # If we have an object, we can try to reload it to get fresh status
+                    # Re-fetch the container status
+                    container.reload()
+                except docker.errors.NotFound:
+                    # It's gone
+                    pass
+                except docker.errors.APIError as e:
+                    if e.is_server_error():
+                        # A daemon hiccup reading the status says nothing about the container:
+                        # keep the session (and, without a volume, its workspace) for the next request
+                        logger.warning("Docker error refreshing session %s: %s", session_id, e)
+                        raise HTTPException(status_code=503, detail="Sandbox is temporarily unavailable. Please try again.")
+                except Exception:
+                    pass
+                else:
                     try:
-                        container.reload()
-                    except docker.errors.NotFound:
-                        # If reload fails, it's gone
-                        del self.active_kernels[session_id]
-                        return self.start_new_container_unlocked(session_id)
-
-                    if container.status == "running":
-                        self.active_kernels[session_id]["last_accessed"] = time.time()
-                        return container
-                    else:
-                        # Restart if stopped
-                        container.start()
-                        self.active_kernels[session_id]["last_accessed"] = time.time()
+                        if container.status == "paused":
+                            # Paused while idle (RCE_SESSION_PAUSE_AFTER)
+                            container.unpause()
+                        elif container.status != "running":
+                            # Restart if stopped
+                            container.start()
+                        with self.lock:
+                            data["paused"] = False
+                            data["last_accessed"] = time.time()
                         return container
-                except Exception:
-                    # Any other error, try to start fresh
-                    del self.active_kernels[session_id]
+                    except Exception as e:
+                        # Errors resuming it tend to persist (e.g. a missing mount source), so
+                        # don't keep retrying: replace the container
+                        logger.warning("Could not resume container of session %s: %s", session_id, e)
+
+                # Start fresh, forgetting the old container and its worker
+                with self.lock:
+                    self.active_kernels.pop(session_id, None)
+                self._release_worker(container)
 
             return self.start_new_container_unlocked(session_id)
 
     def start_new_container(self, session_id: str):
-        with self.lock:
+        with self._session_lock(session_id):
             return self.start_new_container_unlocked(session_id)
 
     def start_new_container_unlocked(self, session_id: str):
-        # Enforce max sessions
-        if len(self.active_kernels) >= RCE_MAX_SESSIONS:
-            logger.warning("Max sessions reached: %d", RCE_MAX_SESSIONS)
-            raise HTTPException(status_code=503, detail="Server is at capacity. Please try again later.")
+        """Starts a container for the session. Caller must hold the session's lock."""
+        # Enforce max sessions, reserving a slot while the container starts
+        evicted = None
+        with self.lock:
+            if len(self.active_kernels) + self._starting >= RCE_MAX_SESSIONS:
+                # Make room by evicting the least recently used idle session
+                evicted = self._pop_lru_session_unlocked()
+                if evicted is None:
+                    logger.warning("Max sessions reached: %d", RCE_MAX_SESSIONS)
+                    raise HTTPException(status_code=503, detail="Server is at capacity. Please try again later.")
+            self._starting += 1
+
+        if evicted:
+            logger.info("Max sessions reached. Evicting least recently used session: %s", evicted[0])
+            # Stopping takes seconds; don't make the new session wait for it
+            threading.Thread(target=self._teardown_session, args=evicted, daemon=True).start()
 
-        # Configuration from environment variables
-        mem_limit = os.environ.get("RCE_MEM_LIMIT", "512m")
-        cpu_limit_nano = int(os.environ.get("RCE_CPU_LIMIT", "500000000")) # 0.5 CPU default
-        network_enabled = os.environ.get("RCE_NETWORK_ENABLED", "false").lower() == "true"
-        gpu_enabled = os.environ.get("RCE_GPU_ENABLED", "false").lower() == "true"
-        
-        device_requests = []
-        if gpu_enabled:
-            device_requests.append(
-                docker.types.DeviceRequest(count=-1, capabilities=[['gpu']])
-            )
+        try:
+            container = self._start_container(session_id)
+            with self.lock:
+                self.active_kernels[session_id] = {
+                    "container": container,
+                    "last_accessed": time.time()
+                }
+            return container
+        finally:
+            with self.lock:
+                self._starting -= 1
+
+    def _start_container(self, session_id: str):
+        # Fast path: adopt a pre-started container from the warm pool
+        container = self._claim_warm_container(session_id)
+        if container is not None:
+            return container
 
         try:
             volumes = {}
@@ -243,53 +613,190 @@ class KernelManager:
                 
                 volumes = {session_dir_host: {'bind': '/mnt/data', 'mode': 'rw'}}
 
-            container = DOCKER_CLIENT.containers.run(
-                image=RCE_IMAGE_NAME,
-                command="tail -f /dev/null", # Keep alive
-                detach=True,
-                remove=True, # Remove when stopped
-                mem_limit=mem_limit,
-                nano_cpus=cpu_limit_nano,
-                network_disabled=not network_enabled,
-                device_requests=device_requests,
-                name=f"rce_{session_id}_{uuid.uuid4().hex[:6]}",
-                working_dir="/mnt/data",
+            container = self._run_container(
+                name=f"rce_{session_id}_{secrets.token_hex(3)}",
                 labels={
                     "managed_by": RCE_MANAGED_BY_VALUE,
                     "session_id": session_id
                 },
-                environment={"PYTHONUNBUFFERED": "1"},
                 volumes=volumes
             )
-            # Ensure workspace exists
-            container.exec_run(cmd=["mkdir", "-p", "/mnt/data"])
-            self.active_kernels[session_id] = {
-                "container": container,
-                "last_accessed": time.time()
-            }
+            # /mnt/data is created by the sandbox images (and by Docker as the working_dir),
+            # so no extra exec round-trip is needed here
             return container
         except Exception:
             logger.exception("Failed to start sandbox for session %s", session_id)
             raise HTTPException(status_code=500, detail="Failed to start sandbox. Please contact an administrator.")
 
+    def _run_container(self, name: str, labels: Dict[str, str], volumes: Dict[str, Dict[str, str]]):
+        """Starts a detached sandbox container with the configured resource limits."""
+        # Configuration from environment variables
+        mem_limit = os.environ.get("RCE_MEM_LIMIT", "512m")
+        cpu_limit_nano = int(os.environ.get("RCE_CPU_LIMIT", "500000000")) # 0.5 CPU default
+        network_enabled = os.environ.get("RCE_NETWORK_ENABLED", "false").lower() == "true"
+        gpu_enabled = os.environ.get("RCE_GPU_ENABLED", "false").lower() == "true"
+        # Optional RAM-backed /tmp: scratch files (e.g. the worker's captured output) skip the
+        # container's writable layer, but count towards the memory limit and are capped in size
+        tmpfs_size = os.environ.get("RCE_TMPFS_SIZE", "")
+        tmpfs = {"/tmp": f"size={tmpfs_size},nosuid"} if tmpfs_size else {}
+        # OCI runtime for sandboxes (e.g. "runsc" for gVisor); unset uses the daemon default
+        runtime = os.environ.get("RCE_RUNTIME") or None
+        
+        device_requests = []
+        if gpu_enabled:
+            device_requests.append(
+                docker.types.DeviceRequest(count=-1, capabilities=[['gpu']])
+            )
+
+        return DOCKER_CLIENT.containers.run(
+            image=RCE_IMAGE_NAME,
+            command="tail -f /dev/null", # Keep alive
+            detach=True,
+            remove=True, # Remove when stopped
+            mem_limit=mem_limit,
+            nano_cpus=cpu_limit_nano,
+            network_disabled=not network_enabled,
+            device_requests=device_requests,
+            name=name,
+            working_dir="/mnt/data",
+            labels=labels,
+            environment={"PYTHONUNBUFFERED": "1"},
+            volumes=volumes,
+            tmpfs=tmpfs,
+            runtime=runtime
+        )
+
+    def _claim_warm_container(self, session_id: str):
+        """
+        Pops a container from the warm pool and binds it to session_id.
+        Returns None if the pool is empty or no pooled container could be adopted.
+        """
+        while True:
+            try:
+                pool_id, container = self.warm_pool.popleft()
+            except IndexError:
+                return None
+
+            if RCE_DATA_DIR_HOST:
+                session_dir_internal = os.path.join(RCE_DATA_DIR_INTERNAL, session_id)
+                if os.path.exists(session_dir_internal):
+                    # The session already has files on the volume; the pooled container cannot
+                    # see them, so fall back to a cold start that mounts the existing directory.
+                    self.warm_pool.appendleft((pool_id, container))
+                    return None
+
+            try:
+                if RCE_WARM_POOL_PAUSE:
+                    container.unpause()
+                if RCE_DATA_DIR_HOST:
+                    # The bind mount follows the directory inode, so renaming the pool directory
+                    # hands its mount over to the session without touching the container.
+                    os.rename(os.path.join(RCE_DATA_DIR_INTERNAL, pool_id), session_dir_internal)
+                container.rename(f"rce_{session_id}_{secrets.token_hex(3)}")
+                logger.info("Assigned warm container %s to session %s", pool_id, session_id)
+                return container
+            except Exception as e:
+                logger.warning("Discarding warm container %s: %s", pool_id, e)
+                self._discard_pool_container(pool_id, container)
+
+    def _discard_pool_container(self, pool_id: str, container=None):
+        """Removes a pool container's workspace directory, worker and container."""
+        if RCE_DATA_DIR_HOST:
+            shutil.rmtree(os.path.join(RCE_DATA_DIR_INTERNAL, pool_id), ignore_errors=True)
+        if container is None:
+            return
+        self._release_worker(container)
+        try:
+            container.stop(timeout=5)
+        except Exception:
+            pass
+
+    def refill_pool(self):
+        """Starts containers until the warm pool reaches RCE_WARM_POOL_SIZE."""
+        while len(self.warm_pool) < RCE_WARM_POOL_SIZE:
+            pool_id = f"pool_{secrets.token_hex(6)}"
+            container = None
+            try:
+                volumes = {}
+                if RCE_DATA_DIR_HOST:
+                    os.makedirs(os.path.join(RCE_DATA_DIR_INTERNAL, pool_id), exist_ok=True)
+                    volumes = {os.path.join(RCE_DATA_DIR_HOST, pool_id): {'bind': '/mnt/data', 'mode': 'rw'}}
+
+                container = self._run_container(
+                    name=f"rce_{pool_id}",
+                    labels={
+                        "managed_by": RCE_MANAGED_BY_VALUE,
+                        "warm_pool": "1"
+                    },
+                    volumes=volumes
+                )
+                if RCE_PYTHON_WORKER:
+                    # Start the interpreter now so the session's first run skips its start-up too
+                    try:
+                        worker = _PythonWorker(container)
+                        with self.lock:
+                            self.workers[container.id] = worker
+                    except Exception as e:
+                        logger.warning("Could not pre-start Python worker in %s: %s", pool_id, e)
+                if RCE_WARM_POOL_PAUSE:
+                    container.pause()
+            except Exception:
+                # Don't leave a directory (or a running container) behind on every pool_loop retry
+                self._discard_pool_container(pool_id, container)
+                raise
+            self.warm_pool.append((pool_id, container))
+            logger.info("Added warm container %s to pool (%d/%d)", pool_id, len(self.warm_pool), RCE_WARM_POOL_SIZE)
+
+    async def pool_loop(self):
+        """Background loop that keeps the warm pool topped up."""
+        while True:
+            try:
+                await asyncio.to_thread(self.refill_pool)
+            except Exception as e:
+                logger.error("Error in warm pool loop: %s", e)
+            await asyncio.sleep(RCE_WARM_POOL_INTERVAL)
+
     def recover_containers(self):
         """Scans Docker for existing containers managed by this API and re-adopts them."""
         logger.info("Scanning for existing containers to recover...")
         try:
+            # Sparse listing: one /containers/json call, instead of an inspect per container.
+            # Labels, names and state are read from the summary fields it returns.
             containers = DOCKER_CLIENT.containers.list(
                 all=True,
-                filters={"label": f"managed_by={RCE_MANAGED_BY_VALUE}"}
+                filters={"label": f"managed_by={RCE_MANAGED_BY_VALUE}"},
+                sparse=True
             )
             with self.lock:
                 for container in containers:
-                    session_id = container.labels.get("session_id")
+                    labels = container.attrs.get("Labels") or {}
+                    status = container.attrs.get("State")
+                    session_id = labels.get("session_id")
+                    if labels.get("warm_pool"):
+                        # Pooled containers carry no session label; the binding lives in the name
+                        # (rce_pool_<hex> while idle, rce_<session_id>_<hex> once assigned).
+                        name = container.attrs["Names"][0].lstrip("/")[len("rce_"):]
+                        if name.startswith("pool_"):
+                            if status in ("running", "paused") and len(self.warm_pool) < RCE_WARM_POOL_SIZE:
+                                # Bring the container in line with the current pause setting
+                                if status == "paused" and not RCE_WARM_POOL_PAUSE:
+                                    container.unpause()
+                                elif status == "running" and RCE_WARM_POOL_PAUSE:
+                                    container.pause()
+                                self.warm_pool.append((name, container))
+                                logger.info("Recovered warm container %s", name)
+                            else:
+                                container.stop(timeout=5)
+                            continue
+                        session_id = name.rsplit("_", 1)[0]
                     if session_id and session_id not in self.active_kernels:
                         try:
                             # We don't auto-start here to avoid load spikes.
                             # They will be started on first request.
                             self.active_kernels[session_id] = {
                                 "container": container,
-                                "last_accessed": time.time()
+                                "last_accessed": time.time(),
+                                "paused": status == "paused"
                             }
                             logger.info("Recovered session %s from container %s", session_id, container.id)
                         except Exception as e:
@@ -297,39 +804,129 @@ class KernelManager:
         except Exception as e:
             logger.error("Error during container recovery: %s", e)
 
+    def _pop_session_unlocked(self, session_id: str):
+        """Drops a session's bookkeeping and returns its kernel data. Caller must hold self.lock."""
+        # Clean up ID mappings
+        nanoid_session = self.session_to_nanoid.pop(session_id, None)
+        if nanoid_session:
+            self.nanoid_to_session.pop(nanoid_session, None)
+            self.file_id_map.pop(nanoid_session, None)
+            self.file_name_to_id.pop(nanoid_session, None)
+        # A held lock is still in use (e.g. a request re-creating the session); dropping it
+        # would let the next request create a second lock for the same session
+        lock = self.session_locks.get(session_id)
+        if lock is not None and not lock.locked():
+            del self.session_locks[session_id]
+        return self.active_kernels.pop(session_id, None)
+
+    def _begin_work(self, session_id: str):
+        """Marks a session as running code, which exempts it from LRU eviction."""
+        with self.lock:
+            self.in_flight[session_id] = self.in_flight.get(session_id, 0) + 1
+
+    def _end_work(self, session_id: str):
+        with self.lock:
+            remaining = self.in_flight.pop(session_id) - 1
+            if remaining:
+                self.in_flight[session_id] = remaining
+            # Idle time counts from the end of the run, not from when it started
+            data = self.active_kernels.get(session_id)
+            if data:
+                data["last_accessed"] = time.time()
+
+    def _pop_lru_session_unlocked(self):
+        """
+        Pops the least recently used session if it has been idle for RCE_EVICT_MIN_IDLE seconds
+        and has no code running. Returns (session_id, data) or None. Caller must hold self.lock.
+        """
+        candidates = [item for item in self.active_kernels.items() if item[0] not in self.in_flight]
+        if not candidates:
+            return None
+        session_id, data = min(candidates, key=lambda item: item[1]["last_accessed"])
+        if time.time() - data["last_accessed"] < RCE_EVICT_MIN_IDLE:
+            return None
+        return session_id, self._pop_session_unlocked(session_id)
+
+    def _teardown_session(self, session_id: str, data):
+        """Removes a popped session's workspace directory and stops its container."""
+        try:
+            # Cleanup internal session directory if volume mounting was used
+            if RCE_DATA_DIR_INTERNAL:
+                session_dir = os.path.join(RCE_DATA_DIR_INTERNAL, session_id)
+                if os.path.exists(session_dir):
+                    shutil.rmtree(session_dir, ignore_errors=True)
+
+            if data:
+                container = data["container"]
+                self._release_worker(container)
+                container.stop(timeout=5)
+                # Since remove=True was used, it should be gone now.
+        except Exception as e:
+            logger.error("Error cleaning up session %s: %s", session_id, e)
+
     def cleanup_sessions(self):
-        """Stops and removes containers that have exceeded the TTL."""
+        """Stops and removes containers that have exceeded the TTL, and drops orphaned bookkeeping."""
         now = time.time()
         to_delete = []
         with self.lock:
             for session_id, data in self.active_kernels.items():
                 if now - data["last_accessed"] > RCE_SESSION_TTL:
                     to_delete.append(session_id)
+            self._drop_orphaned_sessions_unlocked()
 
         for session_id in to_delete:
+            with self.lock:
+                data = self.active_kernels.get(session_id)
+                # The session may have been used since the scan above
+                if not data or time.time() - data["last_accessed"] <= RCE_SESSION_TTL:
+                    continue
+                data = self._pop_session_unlocked(session_id)
             logger.info("Cleaning up idle session: %s", session_id)
-            try:
+            self._teardown_session(session_id, data)
+
+        if RCE_SESSION_PAUSE_AFTER > 0:
+            self._pause_idle_sessions()
+
+    def _pause_idle_sessions(self):
+        """Pauses the containers of sessions idle for RCE_SESSION_PAUSE_AFTER seconds."""
+        now = time.time()
+        with self.lock:
+            candidates = [
+                session_id for session_id, data in self.active_kernels.items()
+                if not data.get("paused") and session_id not in self.in_flight
+                and now - data["last_accessed"] > RCE_SESSION_PAUSE_AFTER
+            ]
+
+        for session_id in candidates:
+            with self._session_lock(session_id):
                 with self.lock:
-                    # Clean up ID mappings
-                    nanoid_session = self.session_to_nanoid.pop(session_id, None)
-                    if nanoid_session:
-                        self.nanoid_to_session.pop(nanoid_session, None)
-                        self.file_id_map.pop(nanoid_session, None)
-
-                    data = self.active_kernels.pop(session_id, None)
-
-                # Cleanup internal session directory if volume mounting was used
-                if RCE_DATA_DIR_INTERNAL:
-                    session_dir = os.path.join(RCE_DATA_DIR_INTERNAL, session_id)
-                    if os.path.exists(session_dir):
-                        shutil.rmtree(session_dir, ignore_errors=True)
-
-                if data:
-                    container = data["container"]
-                    container.stop(timeout=5)
-                    # Since remove=True was used, it should be gone now.
-            except Exception as e:
-                logger.error("Error cleaning up session %s: %s", session_id, e)
+                    data = self.active_kernels.get(session_id)
+                    if (not data or data.get("paused") or session_id in self.in_flight
+                            or time.time() - data["last_accessed"] <= RCE_SESSION_PAUSE_AFTER):
+                        continue
+                    # Flag first: a request arriving now takes the slow path, which waits for
+                    # the session lock and unpauses. If pausing fails, that refresh also
+                    # restarts or replaces the container.
+                    data["paused"] = True
+                try:
+                    data["container"].pause()
+                    logger.info("Paused idle session: %s", session_id)
+                except Exception as e:
+                    logger.error("Failed to pause session %s: %s", session_id, e)
+
+    def _drop_orphaned_sessions_unlocked(self):
+        """
+        Drops ID mappings and locks of sessions whose container never started (e.g. rejected
+        at capacity), which teardown never reaches. A session must be orphaned for a whole
+        cleanup interval first, so one whose container is still starting is left alone.
+        Caller must hold self.lock.
+        """
+        orphans = (self.session_to_nanoid.keys() | self.session_locks.keys()) - self.active_kernels.keys()
+        for session_id in orphans & self._orphaned_sessions:
+            lock = self.session_locks.get(session_id)
+            if lock is None or not lock.locked():
+                self._pop_session_unlocked(session_id)
+        self._orphaned_sessions = orphans
 
     async def cleanup_loop(self):
         """Background loop for periodic cleanup."""
@@ -341,32 +938,61 @@ class KernelManager:
                 logger.error("Error in cleanup loop: %s", e)
             await asyncio.sleep(60) # Run every minute
 
+    def _call_container(self, session_id: str, call, not_found_is_stale: bool = True):
+        """
+        Runs call(container) against the cached container without checking its state first.
+        If Docker reports the container gone or unusable, refreshes the session and retries once.
+        Pass not_found_is_stale=False for calls where NotFound refers to a path in the container.
+        """
+        container = self.get_or_create_container(session_id)
+        try:
+            return call(container)
+        except docker.errors.NotFound:
+            if not not_found_is_stale:
+                raise
+        except docker.errors.APIError:
+            pass
+        container = self.get_or_create_container(session_id, force_refresh=True)
+        return call(container)
+
     def upload_file(self, session_id: str, filename: str, content: bytes):
-        # Sanitize filename to prevent path traversal
-        safe_filename = os.path.basename(filename)
-        if not safe_filename:
-            raise HTTPException(status_code=400, detail="Invalid filename")
+        self.upload_files(session_id, [(filename, io.BytesIO(content))])
+
+    def upload_files(self, session_id: str, files: List[Tuple[str, BinaryIO]]):
+        """
+        Uploads several (filename, file object) pairs to the session workspace.
+        Contents are copied in chunks rather than read into memory; without a shared
+        volume all files travel in a single, streamed put_archive call.
+        """
+        # Sanitize filenames to prevent path traversal
+        safe_files = []
+        for filename, fileobj in files:
+            safe_filename = os.path.basename(filename)
+            if not safe_filename:
+                raise HTTPException(status_code=400, detail="Invalid filename")
+            safe_files.append((safe_filename, fileobj))
 
         if RCE_DATA_DIR_HOST:
+            # Ensure container exists first so a warm container can take over the session directory
+            self.get_or_create_container(session_id)
             session_dir = os.path.join(RCE_DATA_DIR_INTERNAL, session_id)
             os.makedirs(session_dir, exist_ok=True)
-            with open(os.path.join(session_dir, safe_filename), "wb") as f:
-                f.write(content)
-            logger.info("Uploaded file %s to volume (internal: %s) for session %s", safe_filename, session_dir, session_id)
-            # Ensure container exists (even if it doesn't need to do anything now)
-            self.get_or_create_container(session_id)
+            for safe_filename, fileobj in safe_files:
+                fileobj.seek(0)
+                with open(os.path.join(session_dir, safe_filename), "wb") as f:
+                    shutil.copyfileobj(fileobj, f, STREAM_CHUNK_SIZE)
+                logger.info("Uploaded file %s to volume (internal: %s) for session %s", safe_filename, session_dir, session_id)
         else:
-            container = self.get_or_create_container(session_id)
-            tar_stream = io.BytesIO()
-            with tarfile.open(fileobj=tar_stream, mode='w') as tar:
-                tar_info = tarfile.TarInfo(name=safe_filename)
-                tar_info.size = len(content)
-                tar.addfile(tar_info, io.BytesIO(content))
-
-            container.put_archive("/mnt/data", tar_stream.getvalue())
-            logger.info("Uploaded file %s to session %s via put_archive", safe_filename, session_id)
+            # A generator body is sent with chunked transfer encoding as it is produced;
+            # _iter_tar rewinds each file, so a retry re-sends the archive from the start
+            self._call_container(session_id, lambda c: c.put_archive("/mnt/data", _iter_tar(safe_files)))
+            logger.info("Uploaded files %s to session %s via put_archive", [name for name, _ in safe_files], session_id)
 
     def download_file(self, session_id: str, filename: str):
+        """
+        Opens a file in the session workspace for streaming.
+        Returns a tuple of (chunk iterator, size, mtime); the payload is never buffered in full.
+        """
         # Sanitize filename to prevent path traversal
         safe_filename = os.path.basename(filename)
         if not safe_filename:
@@ -376,109 +1002,255 @@ class KernelManager:
             session_dir = os.path.join(RCE_DATA_DIR_INTERNAL, session_id)
             filepath = os.path.join(session_dir, safe_filename)
             if os.path.exists(filepath):
-                with open(filepath, "rb") as f:
-                    content = f.read()
-                mtime = os.path.getmtime(filepath)
-                return content, mtime
+                st = os.stat(filepath)
+                return _iter_file(open(filepath, "rb")), st.st_size, st.st_mtime
             raise FileNotFoundError()
         else:
-            container = self.get_or_create_container(session_id)
             try:
-                # get_archive returns a tuple: (stream, stat)
-                bits, stat = container.get_archive(f"/mnt/data/{safe_filename}")
-
-                # Extract from tar bits
-                tar_stream = io.BytesIO(b"".join(bits))
-                with tarfile.open(fileobj=tar_stream, mode='r') as tar:
-                    # Use the first member from the tar archive for robustness
-                    members = tar.getmembers()
-                    if not members:
-                        raise FileNotFoundError()
-                    f = tar.extractfile(members[0])
-                    if f:
-                        return f.read(), stat.get('mtime', 0)
-                raise FileNotFoundError()
+                # get_archive returns a tuple: (stream, stat).
+                # Request an uncompressed stream: gzip over the local Docker socket only costs CPU.
+                # NotFound here means the file is missing: answer 404 without refreshing the container
+                bits, archive_stat = self._call_container(
+                    session_id, lambda c: c.get_archive(f"/mnt/data/{safe_filename}", encode_stream=False),
+                    not_found_is_stale=False
+                )
+
+                # Parse the tar in streaming mode ('r|') straight off the Docker response
+                tar = tarfile.open(fileobj=_ChunkStream(bits), mode='r|')
+                # Use the first member from the tar archive for robustness
+                member = tar.next()
+                f = tar.extractfile(member) if member else None
+                if f is None:
+                    tar.close()
+                    raise FileNotFoundError()
+                return _iter_file(f, tar), member.size, archive_stat.get('mtime', 0)
+            except HTTPException:
+                raise
             except Exception as e:
                 logger.error("Failed to download file %s from session %s: %s", filename, session_id, e)
                 raise HTTPException(status_code=404, detail="File not found")
 
     def list_files(self, session_id: str):
-        container = self.get_or_create_container(session_id)
-        # Use python to list files to avoid locale-dependent 'ls' formatting/escaping issues.
-        # This ensures we get raw UTF-8 filenames correctly.
-        res = container.exec_run(
-            cmd=["python3", "-c", "import os; print('\\n'.join(os.listdir('/mnt/data')))"]
-        )
+        if RCE_DATA_DIR_HOST:
+            # The workspace is bind-mounted from our side: read it directly, no Docker API call
+            session_dir = os.path.join(RCE_DATA_DIR_INTERNAL, session_id)
+            try:
+                with os.scandir(session_dir) as entries:
+                    # Like 'find -type f', symlinks are not followed
+                    return [e.name for e in entries if e.is_file(follow_symlinks=False)]
+            except FileNotFoundError:
+                return []
+
+        # Use find with NUL-terminated names to avoid locale-dependent 'ls' formatting/escaping issues.
+        # This returns raw UTF-8 filenames without paying for a Python interpreter start per listing.
+        res = self._call_container(session_id, lambda c: c.exec_run(
+            cmd=["find", "/mnt/data", "-mindepth", "1", "-maxdepth", "1", "-type", "f", "-printf", "%f\\0"]
+        ))
         if res.exit_code == 0:
-            files = res.output.decode('utf-8').splitlines()
+            files = res.output.decode('utf-8', errors='replace').split('\0')
             return [f for f in files if f]
         return []
 
-    def _execute_in_container(self, container, code_content: str, path: str, filename: str):
+    def _start_python_exec(self, container, code_content: str):
         """
-        Uploads code to the container and executes it.
+        Starts 'python3 -' in the container and pipes the code into its stdin.
+        Returns (exec_id, socket) with the output still to be read from the socket.
         """
-        tar_stream = io.BytesIO()
-        with tarfile.open(fileobj=tar_stream, mode='w') as tar:
-            code_bytes = code_content.encode('utf-8')
-            tar_info = tarfile.TarInfo(name=filename)
-            tar_info.size = len(code_bytes)
-            tar.addfile(tar_info, io.BytesIO(code_bytes))
-
-        container.put_archive("/mnt/data", tar_stream.getvalue())
-
-        return container.exec_run(
-            cmd=["python3", path],
-            workdir="/mnt/data",
-            demux=True
-        )
+        api = container.client.api
+        exec_id = api.exec_create(
+            container.id,
+            cmd=["python3", "-"],
+            stdin=True,
+            workdir="/mnt/data"
+        )["Id"]
+
+        sock = api.exec_start(exec_id, socket=True)
+        try:
+            # The hijacked connection is wrapped in a SocketIO; write to the raw socket and
+            # half-close it so the interpreter sees EOF on stdin and starts executing.
+            raw_sock = getattr(sock, "_sock", sock)
+            raw_sock.sendall(code_content.encode("utf-8"))
+            raw_sock.shutdown(socket.SHUT_WR)
+        except Exception:
+            sock.close()
+            raise
+        return exec_id, sock
 
-    def execute_code(self, session_id: str, code: str):
+    def _execute_in_container(self, container, code_content: str):
+        """
+        Executes code in the container by piping it into 'python3 -' over the exec's stdin.
+        One exec replaces the former put_archive + exec + 'rm' round-trips and no temp file is written.
+        """
+        exec_id, sock = self._start_python_exec(container, code_content)
+        try:
+            frames = (demux_adaptor(*frame) for frame in frames_iter(sock, tty=False))
+            output = consume_socket_output(frames, demux=True)
+        finally:
+            sock.close()
+
+        exit_code = container.client.api.exec_inspect(exec_id)["ExitCode"]
+        return ExecResult(exit_code, output)
+
+    def execute_code_stream(self, session_id: str, code: str):
+        """
+        Starts code in a one-shot 'python3 -' and returns an iterator over its output as it is
+        produced: ("stdout" | "stderr", bytes) pairs, then a final ("exit_code", int).
+        Nothing is buffered, so output of any size is relayed in constant memory.
+        The session counts as busy until the iterator is exhausted or closed.
+        """
+        self._begin_work(session_id)
+        try:
+            container = self.get_or_create_container(session_id)
+            wrapped_code = wrap_code(code)
+            try:
+                exec_id, sock = self._start_python_exec(container, wrapped_code)
+            except (docker.errors.APIError, docker.errors.NotFound):
+                container = self.get_or_create_container(session_id, force_refresh=True)
+                exec_id, sock = self._start_python_exec(container, wrapped_code)
+        except HTTPException:
+            self._end_work(session_id)
+            raise
+        except Exception:
+            self._end_work(session_id)
+            logger.exception("Error executing code in session %s", session_id)
+            raise HTTPException(status_code=500, detail="An internal error occurred during code execution.")
+
+        chunks = self._iter_exec_output(container.client.api, exec_id, sock, session_id)
+        # Step into the try block, so closing the iterator (or dropping it) before anyone
+        # reads from it still closes the socket and ends the work
+        next(chunks)
+        return chunks
+
+    def _iter_exec_output(self, api, exec_id: str, sock, session_id: str):
+        try:
+            try:
+                yield
+                for stream, data in frames_iter(sock, tty=False):
+                    yield ("stdout" if stream == STDOUT else "stderr", data)
+            finally:
+                sock.close()
+            yield ("exit_code", api.exec_inspect(exec_id)["ExitCode"])
+        finally:
+            self._end_work(session_id)
+
+    def _execute_in_worker(self, container, code_content: str, list_files: bool = False):
+        """
+        Executes code in the container's long-lived Python worker, starting one if needed.
+        Returns (ExecResult, file names or None) like _PythonWorker.run, or None if the worker
+        is busy with another request or cannot be started, in which case the caller falls
+        back to a one-shot 'python3 -'.
+        """
+        with self.lock:
+            worker = self.workers.get(container.id)
+        if worker is not None:
+            if not worker.lock.acquire(blocking=False):
+                return None
+            if not worker.is_alive():
+                worker.lock.release()
+                self._discard_worker(container.id, worker)
+                worker = None
+
+        if worker is None:
+            try:
+                worker = _PythonWorker(container)
+            except Exception:
+                logger.warning("Could not start Python worker in container %s", container.id, exc_info=True)
+                return None
+            worker.lock.acquire()
+            with self.lock:
+                self.workers.setdefault(container.id, worker)
+
+        try:
+            return worker.run(code_content, list_files)
+        except Exception:
+            # The worker died mid-run (os._exit, OOM kill, container stopped). Don't re-run
+            # the code, as it may have had side effects; report the worker's exit instead.
+            logger.warning("Python worker in container %s exited during execution", container.id)
+            self._discard_worker(container.id, worker)
+            try:
+                exit_code = container.client.api.exec_inspect(worker.exec_id)["ExitCode"]
+            except Exception:
+                # The container itself may be gone; raising here would make the caller retry
+                exit_code = None
+            return ExecResult(1 if exit_code is None else exit_code, (None, b"Python process exited unexpectedly.\n")), None
+        finally:
+            worker.lock.release()
+            with self.lock:
+                orphaned = self.workers.get(container.id) is not worker
+            if orphaned:
+                # Another request registered its worker first; this one was single-use
+                worker.close()
+
+    def _release_worker(self, container):
+        """Closes and forgets the Python worker of a container that is being replaced or stopped."""
+        with self.lock:
+            worker = self.workers.pop(container.id, None)
+        if worker:
+            worker.close()
+
+    def _discard_worker(self, container_id: str, worker: "_PythonWorker"):
+        with self.lock:
+            if self.workers.get(container_id) is worker:
+                del self.workers[container_id]
+        worker.close()
+
+    def _run_code(self, container, code_content: str, list_files: bool = False):
+        """Returns (ExecResult, file names or None); only the worker can list files in the same round-trip."""
+        if RCE_PYTHON_WORKER:
+            worker_result = self._execute_in_worker(container, code_content, list_files)
+            if worker_result is not None:
+                return worker_result
+        return self._execute_in_container(container, code_content), None
+
+    def execute_code(self, session_id: str, code: str, output_format: str = "text", list_files: bool = False):
         """
         Executes code within the container.
-        Returns a dictionary with stdout, stderr, and exit_code.
+        Returns a dictionary with stdout, stderr, and exit_code (see format_output for output_format).
+        With list_files, it also carries "files" when the worker listed the workspace after the run;
+        otherwise the caller has to call list_files itself.
         Raises HTTPException for system errors.
         """
+        self._begin_work(session_id)
+        try:
+            return self._execute_code(session_id, code, output_format, list_files)
+        finally:
+            self._end_work(session_id)
+
+    def _execute_code(self, session_id: str, code: str, output_format: str, list_files: bool):
         container = self.get_or_create_container(session_id)
         
         # This implementation provides SECURITY (Isolation) and FILESYSTEM PERSISTENCE.
-        # We write the code to a temporary file inside the container using 'put_archive'
-        # to avoid shell escaping issues and command line length limits.
-        
-        code_filename = f"exec_{uuid.uuid4().hex}.py"
-        container_path = f"/mnt/data/{code_filename}"
+        # The code is streamed to the interpreter's stdin, which avoids shell escaping issues
+        # and command line length limits without writing a temporary file into the workspace.
         
         try:
             # 1. Apply code wrapping for expression-only support
             wrapped_code = wrap_code(code)
 
             try:
-                exec_result = self._execute_in_container(container, wrapped_code, container_path, code_filename)
+                exec_result, files = self._run_code(container, wrapped_code, list_files)
             except (docker.errors.APIError, docker.errors.NotFound):
                 # Optimistic assumption failed: container might be stopped or gone
                 # Recovery: Force refresh and retry once
                 container = self.get_or_create_container(session_id, force_refresh=True)
-                exec_result = self._execute_in_container(container, wrapped_code, container_path, code_filename)
+                exec_result, files = self._run_code(container, wrapped_code, list_files)
             
             stdout, stderr = exec_result.output
 
-            return {
-                "stdout": stdout.decode("utf-8") if stdout else "",
-                "stderr": stderr.decode("utf-8") if stderr else "",
+            result = {
+                **format_output("stdout", stdout, output_format),
+                **format_output("stderr", stderr, output_format),
                 "exit_code": exec_result.exit_code
             }
+            if files is not None:
+                result["files"] = files
+            return result
             
         except HTTPException:
             raise
         except Exception:
             logger.exception("Error executing code in session %s", session_id)
             raise HTTPException(status_code=500, detail="An internal error occurred during code execution.")
-        finally:
-            # 3. Cleanup: remove the temporary file
-            try:
-                container.exec_run(cmd=["rm", container_path])
-            except Exception:
-                pass
 
 kernel_manager = KernelManager()
 
@@ -497,6 +1269,10 @@ class CodeRequest(BaseModel):
     user_id: Optional[str] = None
     files: Optional[List[FileInput]] = []
     args: Optional[List[str]] = []
+    # "text" decodes output, "bytes" returns it base64-encoded, "auto" does so only for large output
+    output_format: Literal["text", "bytes", "auto"] = "text"
+    # Clients that don't need the workspace listing can skip its extra round-trip
+    return_files: bool = True
 
 class FileInfo(BaseModel):
     model_config = ConfigDict(extra="allow")
@@ -517,21 +1293,116 @@ class CodeResponse(BaseModel):
     files: Optional[List[FileInfo]] = []
     images: List[Dict[str, Any]] = [] # Matplotlib images or other plot captures
 
+class UploadedFile(BaseModel):
+    model_config = ConfigDict(extra="allow")
+    fileId: str
+    filename: str
+
+class UploadResponse(BaseModel):
+    # The first file's fileId/filename are also flattened onto the root as extra fields
+    model_config = ConfigDict(extra="allow")
+    message: str
+    session_id: str
+    files: List[UploadedFile]
+
+class SessionFile(BaseModel):
+    model_config = ConfigDict(extra="allow")
+    filename: str
+    fileId: str
+    id: str
+
+def assign_file_ids(nanoid_session: str, filenames: List[str]) -> List[str]:
+    """Returns the file ID of each filename in the session, generating IDs for new names."""
+    with kernel_manager.lock:
+        id_map = kernel_manager.file_id_map.setdefault(nanoid_session, {})
+        # The inverse map makes each lookup O(1) instead of rebuilding it per file
+        name_map = kernel_manager.file_name_to_id.setdefault(nanoid_session, {})
+        file_ids = []
+        for f in filenames:
+            nanoid_file = name_map.get(f)
+            if nanoid_file is None:
+                nanoid_file = generate_nanoid()
+                id_map[nanoid_file] = f
+                name_map[f] = nanoid_file
+            file_ids.append(nanoid_file)
+        return file_ids
+
+def register_files(nanoid_session: str, filenames: List[str]) -> List[Dict[str, str]]:
+    """Assigns (or reuses) file IDs for workspace files and formats them for LibreChat."""
+    return [
+        {
+            "id": nanoid_file,
+            "name": f,
+            "url": f"/api/files/code/download/{nanoid_session}/{nanoid_file}",
+            "type": guess_mime_type(f)
+        }
+        for f, nanoid_file in zip(filenames, assign_file_ids(nanoid_session, filenames))
+    ]
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def exec_event_stream(chunks, session_id: str, nanoid_session: str, list_files: bool = True):
+    """
+    Turns execute_code_stream output into server-sent events: 'stdout'/'stderr' events carrying
+    text as it arrives, then a 'done' event with the exit code, session ID and files.
+    A sync generator, so StreamingResponse iterates it (and its blocking reads) in a thread.
+    """
+    decoders = {name: codecs.getincrementaldecoder("utf-8")(errors="replace") for name in ("stdout", "stderr")}
+    exit_code = -1
+    for kind, data in chunks:
+        if kind == "exit_code":
+            exit_code = data
+            continue
+        # Incremental decoding keeps multi-byte characters split across frames intact
+        text = decoders[kind].decode(data)
+        if text:
+            yield _sse(kind, text)
+    for kind, decoder in decoders.items():
+        text = decoder.decode(b"", final=True)
+        if text:
+            yield _sse(kind, text)
+
+    files = []
+    if list_files:
+        files = register_files(nanoid_session, kernel_manager.list_files(session_id))
+    yield _sse("done", {
+        "exit_code": exit_code,
+        "status": "success" if exit_code == 0 else "error",
+        "session_id": nanoid_session,
+        "files": files
+    })
+
 # 4. Endpoints
 @app.on_event("startup")
 async def startup_event():
+    # asyncio's default executor (min(32, cpu + 4) threads) would cap concurrent /exec calls
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=RCE_THREAD_POOL_SIZE, thread_name_prefix="rce")
+    )
+    # Starlette runs sync work (streamed download chunks, UploadFile reads) through anyio's
+    # own thread limiter, 40 threads by default; give it the same headroom
+    anyio.to_thread.current_default_thread_limiter().total_tokens = RCE_THREAD_POOL_SIZE
     # Recover existing containers
-    kernel_manager.recover_containers()
+    await asyncio.to_thread(kernel_manager.recover_containers)
     # Start cleanup background task
     asyncio.create_task(kernel_manager.cleanup_loop())
+    # Keep idle containers ready so new sessions skip the container cold start
+    if RCE_WARM_POOL_SIZE > 0:
+        asyncio.create_task(kernel_manager.pool_loop())
 
 @app.post("/exec", response_model=CodeResponse)
 @app.post("/run/exec", response_model=CodeResponse)
-async def run_code(req: CodeRequest, key: str = Security(get_api_key)):
+async def run_code(req: CodeRequest, request: Request, key: str = Security(get_api_key)):
     """
     Executes code in a sandboxed Docker container.
+    With 'Accept: text/event-stream', output is streamed as server-sent events.
     """
-    logger.info("Exec request received. Request body: %s", req.model_dump())
+    # Log a summary only: dumping the model copies and formats the whole code string
+    logger.info(
+        "Exec request received. session_id=%s, files=%d, code_len=%d",
+        req.session_id, len(req.files or []), len(req.code)
+    )
     
     # Extract session_id from files array if root session_id is missing (LibreChat behavior)
     effective_session_id = req.session_id
@@ -562,36 +1433,35 @@ async def run_code(req: CodeRequest, key: str = Security(get_api_key)):
         else:
             nanoid_session = kernel_manager.session_to_nanoid[real_session_id]
     
-    # Run in sandbox
-    result = kernel_manager.execute_code(real_session_id, req.code)
-    
-    # List generated files and format them for LibreChat native ingestion
-    current_files = kernel_manager.list_files(real_session_id)
-    structured_files = []
+    list_files = RCE_LIST_FILES_ON_EXEC and req.return_files
+
+    if "text/event-stream" in request.headers.get("accept", ""):
+        # Relay output as server-sent events while the code runs instead of buffering it
+        chunks = await asyncio.to_thread(kernel_manager.execute_code_stream, real_session_id, req.code)
+        return StreamingResponse(
+            exec_event_stream(chunks, real_session_id, nanoid_session, list_files),
+            media_type="text/event-stream",
+            # Also runs when the client disconnects before the body is read
+            background=BackgroundTask(chunks.close)
+        )
+
+    # Run in sandbox. Docker SDK calls are blocking, so run them in a worker thread
+    # to keep the event loop free for other requests.
+    result = await asyncio.to_thread(
+        kernel_manager.execute_code, real_session_id, req.code,
+        output_format=req.output_format, list_files=list_files
+    )
     
-    # Initialize file mapping for this session
-    with kernel_manager.lock:
-        if nanoid_session not in kernel_manager.file_id_map:
-            kernel_manager.file_id_map[nanoid_session] = {}
+    # List generated files and format them for LibreChat native ingestion.
+    # The Python worker returns the listing with the result; otherwise it takes another exec.
+    current_files = []
+    if list_files:
+        current_files = result.get("files")
+        if current_files is None:
+            current_files = await asyncio.to_thread(kernel_manager.list_files, real_session_id)
+    structured_files = register_files(nanoid_session, current_files)
     
-    for f in current_files:
-        mime_type, _ = mimetypes.guess_type(f)
-        # Generate or reuse nanoid for this file
-        with kernel_manager.lock:
-            existing_ids = {v: k for k, v in kernel_manager.file_id_map[nanoid_session].items()}
-            if f in existing_ids:
-                nanoid_file = existing_ids[f]
-            else:
-                nanoid_file = generate_nanoid()
-                kernel_manager.file_id_map[nanoid_session][nanoid_file] = f
-        structured_files.append({
-            "id": nanoid_file,
-            "name": f,
-            "url": f"/api/files/code/download/{nanoid_session}/{nanoid_file}",
-            "type": mime_type or "application/octet-stream"
-        })
-    
-    return {
+    response = {
         "stdout": result["stdout"],
         "stderr": result["stderr"],
         "exit_code": result["exit_code"],
@@ -602,8 +1472,13 @@ async def run_code(req: CodeRequest, key: str = Security(get_api_key)):
         "files": structured_files,
         "images": [] # Placeholder for future image capture implementation
     }
+    # Base64-encoded output (output_format "bytes", or large output with "auto")
+    for key in ("stdout_b64", "stderr_b64"):
+        if key in result:
+            response[key] = result[key]
+    return response
 
-@app.post("/upload")
+@app.post("/upload", response_model=UploadResponse)
 async def upload_files(
     entity_id: Optional[str] = Form(None),
     session_id: Optional[str] = Form(None),
@@ -649,24 +1524,18 @@ async def upload_files(
             
             nanoid_session = kernel_manager.session_to_nanoid.get(real_session_id, sid)
 
-        uploaded_files = []
-        for f in upload_list:
-            content = await f.read()
-            kernel_manager.upload_file(real_session_id, f.filename, content)
-
-            # Ensure file mapping exists
-            with kernel_manager.lock:
-                if nanoid_session not in kernel_manager.file_id_map:
-                    kernel_manager.file_id_map[nanoid_session] = {}
-
-                existing_ids = {v: k for k, v in kernel_manager.file_id_map[nanoid_session].items()}
-                if f.filename in existing_ids:
-                    file_id = existing_ids[f.filename]
-                else:
-                    file_id = generate_nanoid()
-                    kernel_manager.file_id_map[nanoid_session][file_id] = f.filename
+        # Stream the spooled parts straight to the sandbox in one batch instead of reading them into memory
+        await asyncio.to_thread(
+            kernel_manager.upload_files,
+            real_session_id,
+            [(f.filename, f.file) for f in upload_list]
+        )
 
-            uploaded_files.append({"fileId": file_id, "filename": f.filename})
+        filenames = [f.filename for f in upload_list]
+        uploaded_files = [
+            {"fileId": file_id, "filename": filename}
+            for filename, file_id in zip(filenames, assign_file_ids(nanoid_session, filenames))
+        ]
         
         # Standardize response structure
         res = {
@@ -686,24 +1555,23 @@ async def upload_files(
         logger.exception("Error processing upload")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/files/{session_id}")
+@app.get("/files/{session_id}", response_model=List[SessionFile])
 async def list_session_files(session_id: str, key: str = Security(get_api_key)):
     """
     Lists files in a session's sandbox.
     """
     real_session_id = kernel_manager.resolve_session_id(sanitize_id(session_id))
-    files = kernel_manager.list_files(real_session_id)
+    files = await asyncio.to_thread(kernel_manager.list_files, real_session_id)
     
     file_list = []
     nanoid_session = kernel_manager.session_to_nanoid.get(real_session_id, sanitize_id(session_id))
     with kernel_manager.lock:
-        id_map = kernel_manager.file_id_map.get(nanoid_session, {})
-        reversed_map = {v: k for k, v in id_map.items()}
+        name_map = kernel_manager.file_name_to_id.get(nanoid_session, {})
         for f in files:
             file_list.append({
                 "filename": f,
-                "fileId": reversed_map.get(f, ""),
-                "id": reversed_map.get(f, "")
+                "fileId": name_map.get(f, ""),
+                "id": name_map.get(f, "")
             })
             
     return file_list
@@ -711,7 +1579,6 @@ async def list_session_files(session_id: str, key: str = Security(get_api_key)):
 @app.get("/download")
 @app.get("/run/download")
 async def download_file_query(
-    background_tasks: BackgroundTasks,
     session_id: str = Query(...),
     filename: str = Query(...),
     key: str = Security(get_api_key)
@@ -719,7 +1586,7 @@ async def download_file_query(
     """
     Downloads a file from a session's sandbox using query parameters.
     """
-    return await download_session_file(session_id, filename, background_tasks, key)
+    return await download_session_file(session_id, filename, key)
 
 @app.get("/api/files/code/download/{session_id}/{filename}")
 @app.get("/download/{session_id}/{filename}")
@@ -727,13 +1594,13 @@ async def download_file_query(
 async def download_session_file(
     session_id: str,
     filename: str,
-    background_tasks: BackgroundTasks,
     key: Optional[str] = Security(get_api_key)
 ):
     """
     Downloads a file from a session's sandbox using path parameters.
     Supports nanoid-format IDs (used by LibreChat) and direct session_id/filename.
-    Uses FileResponse to ensure perfect streaming header compatibility with LibreChat's Axios proxy.
+    Volume-mounted files are served with FileResponse; otherwise the file is streamed
+    out of the container archive chunk by chunk.
     """
     # Sanitize inputs
     s_session_id = sanitize_id(session_id)
@@ -749,33 +1616,26 @@ async def download_session_file(
             real_filename = kernel_manager.file_id_map[s_session_id][s_filename]
     
     # Determine the file path if volume mounting is enabled
+    filepath = None
     if RCE_DATA_DIR_HOST:
         session_dir = os.path.join(RCE_DATA_DIR_INTERNAL, real_session_id)
         filepath = os.path.join(session_dir, real_filename)
-        if not os.path.exists(filepath):
+        try:
+            # Handed to FileResponse so it doesn't stat the file again
+            file_stat = os.stat(filepath)
+        except OSError:
+            file_stat = None
+        if file_stat is None or not stat.S_ISREG(file_stat.st_mode):
              raise HTTPException(status_code=404, detail="File not found")
-        tmp_filepath = filepath
-        cleanup_needed = False
     else:
-        # Fallback to Docker API (get_archive)
-        content, mtime = kernel_manager.download_file(real_session_id, real_filename)
-        # Create a secure temporary file
-        with tempfile.NamedTemporaryFile(delete=False) as tmp:
-            tmp.write(content)
-            tmp_filepath = tmp.name
-        cleanup_needed = True
+        # Fallback to Docker API (get_archive), streamed without a temporary file
+        chunks, size, mtime = await asyncio.to_thread(kernel_manager.download_file, real_session_id, real_filename)
 
     # Guess MIME type
-    mime_type, _ = mimetypes.guess_type(real_filename)
-    if not mime_type:
-        mime_type = "application/octet-stream"
+    mime_type = guess_mime_type(real_filename)
 
     # Use inline for images and PDFs to allow them to be displayed in the chat interface
     disposition = "inline" if mime_type.startswith(("image/", "application/pdf")) else "attachment"
-    
-    # Ensure temporary file is deleted if it was created
-    if cleanup_needed:
-        background_tasks.add_task(os.remove, tmp_filepath)
 
     # Manually construct Content-Disposition header to ensure maximum compatibility with Japanese filenames.
     # Starlette's default FileResponse might not always provide the filename="..." fallback correctly for non-ASCII.
@@ -786,11 +1646,17 @@ async def download_session_file(
         "Content-Disposition": f"{disposition}; filename=\"{safe_filename_ascii}\"; filename*=utf-8''{filename_encoded}"
     }
 
-    return FileResponse(
-        path=tmp_filepath,
-        media_type=mime_type,
-        headers=headers
-    )
+    if filepath:
+        return FileResponse(
+            path=filepath,
+            media_type=mime_type,
+            headers=headers,
+            stat_result=file_stat
+        )
+
+    # The size is known from the tar header, so LibreChat's proxy still gets a Content-Length
+    headers["Content-Length"] = str(size)
+    return StreamingResponse(chunks, media_type=mime_type, headers=headers)
 
 @app.get("/health")
 def health_check():
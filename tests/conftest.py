@@ -2,5 +2,25 @@
 # No sys.modules mocking here. Each test file should use its own mocking strategy
 # to avoid cross-test pollution.
 #
-# Files that test KernelManager internals use unittest.mock.patch for main.DOCKER_CLIENT
-# Files that use FastAPI TestClient import real docker and main modules
+# Files that test KernelManager internals use the `mock_docker_client` fixture below
+# Files that use FastAPI TestClient import real docker and main modules, and share the
+# session-scoped `client` fixture below
+import pytest
+from unittest.mock import MagicMock
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture(scope="session")
+def client():
+    """One TestClient for the whole run. Lifespan events are not entered, so nothing is recovered or pooled."""
+    from main import app
+    return TestClient(app)
+
+
+@pytest.fixture
+def mock_docker_client(monkeypatch):
+    """Replaces main.DOCKER_CLIENT with a MagicMock for one test, restoring the real client afterwards."""
+    import main
+    mock_client = MagicMock()
+    monkeypatch.setattr(main, "DOCKER_CLIENT", mock_client)
+    return mock_client
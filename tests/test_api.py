@@ -1,22 +1,26 @@
-from unittest.mock import MagicMock, patch
-from fastapi.testclient import TestClient
-from main import app, API_KEY
+import asyncio
+import threading
+import anyio
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+import main
+from main import API_KEY, guess_mime_type
 
-client = TestClient(app)
-
-def test_health_check():
+def test_health_check(client):
     response = client.get("/health")
     assert response.status_code == 200
     assert response.json() == {"status": "ok", "mode": "docker-sandboxed"}
 
-def test_run_code_unauthorized():
-    response = client.post("/exec", json={"code": "print('hello')", "session_id": "test"}, headers={"X-API-Key": "wrong_key"})
+@pytest.mark.parametrize("path", ["/exec", "/run/exec"])
+@pytest.mark.parametrize("headers", [{}, {"X-API-Key": "wrong_key"}], ids=["missing", "wrong"])
+def test_run_code_unauthorized(client, path, headers):
+    response = client.post(path, json={"code": "print('hello')", "session_id": "test"}, headers=headers)
     assert response.status_code == 401
     assert response.json()["detail"] == "Invalid API Key"
 
 @patch("main.kernel_manager.execute_code")
 @patch("main.kernel_manager.list_files")
-def test_run_code_success(mock_list_files, mock_execute):
+def test_run_code_success(mock_list_files, mock_execute, client):
     mock_execute.return_value = {"stdout": "hello\n", "stderr": "", "exit_code": 0}
     mock_list_files.return_value = []
 
@@ -27,11 +31,11 @@ def test_run_code_success(mock_list_files, mock_execute):
     assert response.status_code == 200
     assert response.json()["stdout"] == "hello\n"
     assert response.json()["exit_code"] == 0
-    mock_execute.assert_called_once_with("test_session", "print('hello')")
+    mock_execute.assert_called_once_with("test_session", "print('hello')", output_format="text", list_files=True)
 
 @patch("main.kernel_manager.execute_code")
 @patch("main.kernel_manager.list_files")
-def test_run_exec_success(mock_list_files, mock_execute):
+def test_run_exec_success(mock_list_files, mock_execute, client):
     mock_execute.return_value = {"stdout": "exec_output", "stderr": "", "exit_code": 0}
     mock_list_files.return_value = []
 
@@ -41,11 +45,11 @@ def test_run_exec_success(mock_list_files, mock_execute):
 
     assert response.status_code == 200
     assert response.json()["stdout"] == "exec_output"
-    mock_execute.assert_called_once_with("test_session_exec", "print('exec')")
+    mock_execute.assert_called_once_with("test_session_exec", "print('exec')", output_format="text", list_files=True)
 
 @patch("main.kernel_manager.execute_code")
 @patch("main.kernel_manager.list_files")
-def test_run_code_no_session_id(mock_list_files, mock_execute):
+def test_run_code_no_session_id(mock_list_files, mock_execute, client):
     mock_execute.return_value = {"stdout": "ok", "stderr": "", "exit_code": 0}
     mock_list_files.return_value = []
 
@@ -60,21 +64,202 @@ def test_run_code_no_session_id(mock_list_files, mock_execute):
     assert len(args[0]) > 0  # session_id generated
 
 @patch("main.kernel_manager.list_files")
-def test_auth_precedence_header_wins(mock_list_files):
+def test_auth_precedence_header_wins(mock_list_files, client):
     mock_list_files.return_value = []
     # Valid header, invalid query param -> should succeed
     response = client.get("/files/test", headers={"X-API-Key": API_KEY}, params={"api_key": "wrong_key"})
     assert response.status_code == 200
 
-def test_auth_precedence_invalid_header_fails():
+def test_auth_precedence_invalid_header_fails(client):
     # Invalid header, valid query param -> should fail 401
     # Because the header is present (not None), it's chosen as 'key', and then validated.
     response = client.get("/files/test", headers={"X-API-Key": "wrong_key"}, params={"api_key": API_KEY})
     assert response.status_code == 401
 
 @patch("main.kernel_manager.list_files")
-def test_auth_query_fallback_success(mock_list_files):
+def test_auth_query_fallback_success(mock_list_files, client):
     mock_list_files.return_value = []
     # No header, valid query param -> should succeed
     response = client.get("/files/test", params={"api_key": API_KEY})
     assert response.status_code == 200
+
+@patch("main.kernel_manager.execute_code")
+@patch("main.kernel_manager.list_files")
+def test_run_code_offloads_docker_calls(mock_list_files, mock_execute, client):
+    import asyncio
+    on_event_loop = []
+
+    def record_loop():
+        try:
+            asyncio.get_running_loop()
+            on_event_loop.append(True)
+        except RuntimeError:
+            on_event_loop.append(False)
+
+    mock_execute.side_effect = lambda *args, **kwargs: record_loop() or {"stdout": "", "stderr": "", "exit_code": 0}
+    mock_list_files.side_effect = lambda *args: record_loop() or []
+
+    response = client.post("/exec",
+                           json={"code": "pass", "session_id": "thread_session"},
+                           headers={"X-API-Key": API_KEY})
+
+    assert response.status_code == 200
+    # Blocking Docker work must run in a worker thread, not on the event loop
+    assert on_event_loop == [False, False]
+
+@patch("main.RCE_LIST_FILES_ON_EXEC", False)
+@patch("main.kernel_manager.execute_code")
+@patch("main.kernel_manager.list_files")
+def test_run_code_skips_listing_when_disabled(mock_list_files, mock_execute, client):
+    mock_execute.return_value = {"stdout": "ok", "stderr": "", "exit_code": 0}
+
+    response = client.post("/exec",
+                           json={"code": "print('ok')", "session_id": "no_list_session"},
+                           headers={"X-API-Key": API_KEY})
+
+    assert response.status_code == 200
+    assert response.json()["files"] == []
+    mock_list_files.assert_not_called()
+
+@patch("main.kernel_manager.execute_code")
+@patch("main.kernel_manager.list_files", return_value=[])
+def test_run_code_returns_base64_output(mock_list_files, mock_execute, client):
+    mock_execute.return_value = {"stdout": "", "stdout_b64": "AAE=", "stderr": "", "exit_code": 0}
+
+    response = client.post("/exec",
+                           json={"code": "pass", "session_id": "bytes_session", "output_format": "bytes"},
+                           headers={"X-API-Key": API_KEY})
+
+    assert response.status_code == 200
+    assert response.json()["stdout_b64"] == "AAE="
+    assert "stderr_b64" not in response.json()
+    assert mock_execute.call_args.kwargs == {"output_format": "bytes", "list_files": True}
+
+@patch("main.kernel_manager.execute_code")
+@patch("main.kernel_manager.list_files")
+def test_run_code_uses_listing_returned_with_result(mock_list_files, mock_execute, client):
+    mock_execute.return_value = {"stdout": "", "stderr": "", "exit_code": 0, "files": ["plot.png"]}
+
+    response = client.post("/exec",
+                           json={"code": "pass", "session_id": "worker_session"},
+                           headers={"X-API-Key": API_KEY})
+
+    assert response.status_code == 200
+    assert [f["name"] for f in response.json()["files"]] == ["plot.png"]
+    mock_list_files.assert_not_called()
+
+def test_run_code_rejects_unknown_output_format(client):
+    response = client.post("/exec",
+                           json={"code": "pass", "output_format": "hex"},
+                           headers={"X-API-Key": API_KEY})
+    assert response.status_code == 422
+
+@patch("main.kernel_manager.execute_code_stream")
+@patch("main.kernel_manager.list_files", return_value=["out.png"])
+def test_run_code_streams_server_sent_events(mock_list_files, mock_stream, client):
+    import json
+    # A multi-byte character split across two frames
+    mock_stream.return_value = (chunk for chunk in [
+        ("stdout", b"caf\xc3"), ("stdout", b"\xa9\n"), ("stderr", b"warn\n"), ("exit_code", 0)
+    ])
+
+    response = client.post("/exec",
+                           json={"code": "print('café')", "session_id": "sse_session"},
+                           headers={"X-API-Key": API_KEY, "Accept": "text/event-stream"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        event_line, data_line = block.split("\n")
+        events.append((event_line[len("event: "):], json.loads(data_line[len("data: "):])))
+
+    assert events[:3] == [("stdout", "caf"), ("stdout", "é\n"), ("stderr", "warn\n")]
+    name, done = events[3]
+    assert name == "done"
+    assert done["exit_code"] == 0 and done["status"] == "success"
+    assert [f["name"] for f in done["files"]] == ["out.png"]
+    assert done["files"][0]["type"] == "image/png"
+
+@pytest.mark.parametrize("filename, expected", [
+    ("plot.png", "image/png"),
+    ("PLOT.PNG", "image/png"),
+    ("data.v2.csv", "text/csv"),
+    ("archive.tar.gz", "application/x-tar"),
+    ("Makefile", "application/octet-stream"),
+])
+def test_guess_mime_type(filename, expected):
+    assert guess_mime_type(filename) == expected
+
+@patch("main.kernel_manager.execute_code")
+@patch("main.kernel_manager.list_files")
+def test_run_code_return_files_false_skips_listing(mock_list_files, mock_execute, client):
+    mock_execute.return_value = {"stdout": "42\n", "stderr": "", "exit_code": 0}
+
+    response = client.post("/exec",
+                           json={"code": "print(42)", "session_id": "calc_session", "return_files": False},
+                           headers={"X-API-Key": API_KEY})
+
+    assert response.status_code == 200
+    assert response.json()["stdout"] == "42\n"
+    assert response.json()["files"] == []
+    mock_list_files.assert_not_called()
+
+def test_assign_file_ids_reuses_ids_via_inverse_map():
+    from main import assign_file_ids, kernel_manager
+    first = assign_file_ids("inverse_session", ["a.csv", "b.png"])
+    second = assign_file_ids("inverse_session", ["b.png", "c.txt", "a.csv"])
+
+    assert second[0] == first[1] and second[2] == first[0]
+    assert second[1] not in first
+    with kernel_manager.lock:
+        id_map = kernel_manager.file_id_map["inverse_session"]
+        name_map = kernel_manager.file_name_to_id["inverse_session"]
+        assert name_map == {v: k for k, v in id_map.items()}
+
+def test_startup_sizes_thread_pools(mocker, monkeypatch):
+    async def start():
+        await main.startup_event()
+        thread = await asyncio.to_thread(threading.current_thread)
+        return thread.name, anyio.to_thread.current_default_thread_limiter().total_tokens
+
+    monkeypatch.setattr(main, "RCE_THREAD_POOL_SIZE", 123)
+    monkeypatch.setattr(main, "RCE_WARM_POOL_SIZE", 0)
+    mocker.patch("main.kernel_manager.recover_containers")
+    mocker.patch("main.kernel_manager.cleanup_loop", new_callable=AsyncMock)
+    thread_name, limiter_tokens = asyncio.run(start())
+
+    assert thread_name.startswith("rce")
+    assert limiter_tokens == 123
+
+def test_download_volume_file_served_from_disk(tmp_path, client, monkeypatch):
+    session_dir = tmp_path / "sess"
+    session_dir.mkdir()
+    (session_dir / "out.csv").write_text("a,b\n")
+    (session_dir / "subdir").mkdir()
+
+    monkeypatch.setattr(main, "RCE_DATA_DIR_HOST", "/host/data")
+    monkeypatch.setattr(main, "RCE_DATA_DIR_INTERNAL", str(tmp_path))
+    ok = client.get("/download/sess/out.csv", headers={"X-API-Key": API_KEY})
+    directory = client.get("/download/sess/subdir", headers={"X-API-Key": API_KEY})
+
+    assert ok.status_code == 200
+    assert ok.content == b"a,b\n"
+    assert ok.headers["content-length"] == "4"
+    assert directory.status_code == 404
+
+@pytest.mark.parametrize("filename, mime_type, disposition", [
+    ("plot.png", "image/png", "inline"),
+    ("report.pdf", "application/pdf", "inline"),
+    ("data.csv", "text/csv", "attachment"),
+    ("blob", "application/octet-stream", "attachment"),
+])
+def test_download_mime_type_and_disposition(client, mocker, monkeypatch, filename, mime_type, disposition):
+    monkeypatch.setattr(main, "RCE_DATA_DIR_HOST", None)
+    mocker.patch("main.kernel_manager.download_file", return_value=(iter([b"x"]), 1, 0))
+
+    response = client.get(f"/download/sess/{filename}", headers={"X-API-Key": API_KEY})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].split(";")[0] == mime_type
+    assert response.headers["content-disposition"].startswith(f'{disposition}; filename="{filename}"')
@@ -1,45 +1,64 @@
 import pytest
 import asyncio
-from unittest.mock import patch, MagicMock
 from fastapi import HTTPException
 import main
 
-def test_get_api_key_valid():
+@pytest.fixture(scope="module")
+def run():
+    """Runs coroutines on one event loop shared by the module, instead of a new loop per call."""
+    with asyncio.Runner() as runner:
+        yield runner.run
+
+@pytest.fixture
+def api_key(monkeypatch):
+    """Returns a setter for the configured API key (and its cached encoding), undone after the test."""
+    def set_api_key(value):
+        monkeypatch.setattr(main, "API_KEY", value)
+        monkeypatch.setattr(main, "API_KEY_BYTES", value.encode("utf-8"))
+    return set_api_key
+
+def test_get_api_key_valid(run, api_key):
     """Test get_api_key with a valid key using direct variable mocking."""
-    with patch("main.API_KEY", "valid-test-key"):
-        result = asyncio.run(main.get_api_key("valid-test-key"))
-        assert result == "valid-test-key"
+    api_key("valid-test-key")
+    result = run(main.get_api_key("valid-test-key"))
+    assert result == "valid-test-key"
 
-def test_get_api_key_invalid():
+def test_get_api_key_invalid(run, api_key):
     """Test get_api_key with an invalid key."""
-    with patch("main.API_KEY", "valid-test-key"):
-        with pytest.raises(HTTPException) as excinfo:
-            asyncio.run(main.get_api_key("wrong-key"))
-        assert excinfo.value.status_code == 401
-        assert excinfo.value.detail == "Invalid API Key"
+    api_key("valid-test-key")
+    with pytest.raises(HTTPException) as excinfo:
+        run(main.get_api_key("wrong-key"))
+    assert excinfo.value.status_code == 401
+    assert excinfo.value.detail == "Invalid API Key"
 
-def test_get_api_key_header_precedence():
+def test_get_api_key_header_precedence(run, api_key):
     """Test that header takes precedence over query parameter when both are present and header is valid."""
-    with patch("main.API_KEY", "valid-key"):
-        result = asyncio.run(main.get_api_key("valid-key", "invalid-key"))
-        assert result == "valid-key"
+    api_key("valid-key")
+    result = run(main.get_api_key("valid-key", "invalid-key"))
+    assert result == "valid-key"
 
-def test_get_api_key_header_invalid_query_valid():
+def test_get_api_key_header_invalid_query_valid(run, api_key):
     """Test that if an invalid header is provided, it fails even if a valid query parameter is also provided."""
-    with patch("main.API_KEY", "valid-key"):
-        with pytest.raises(HTTPException) as excinfo:
-            asyncio.run(main.get_api_key("invalid-key", "valid-key"))
-        assert excinfo.value.status_code == 401
+    api_key("valid-key")
+    with pytest.raises(HTTPException) as excinfo:
+        run(main.get_api_key("invalid-key", "valid-key"))
+    assert excinfo.value.status_code == 401
 
-def test_get_api_key_query_fallback():
+def test_get_api_key_query_fallback(run, api_key):
     """Test that if no header is provided, it correctly uses a valid query parameter."""
-    with patch("main.API_KEY", "valid-key"):
-        result = asyncio.run(main.get_api_key(None, "valid-key"))
-        assert result == "valid-key"
+    api_key("valid-key")
+    result = run(main.get_api_key(None, "valid-key"))
+    assert result == "valid-key"
 
-def test_get_api_key_both_missing():
+def test_get_api_key_both_missing(run, api_key):
     """Test that if neither header nor query parameter is provided, it fails."""
-    with patch("main.API_KEY", "valid-key"):
-        with pytest.raises(HTTPException) as excinfo:
-            asyncio.run(main.get_api_key(None, None))
-        assert excinfo.value.status_code == 401
+    api_key("valid-key")
+    with pytest.raises(HTTPException) as excinfo:
+        run(main.get_api_key(None, None))
+    assert excinfo.value.status_code == 401
+
+def test_get_api_key_non_ascii_rejected(run, api_key):
+    api_key("valid-key")
+    with pytest.raises(HTTPException) as excinfo:
+        run(main.get_api_key("vålid-key"))
+    assert excinfo.value.status_code == 401
@@ -1,35 +1,67 @@
+import pytest
+from unittest.mock import patch
 import main
 
-def test_wrap_code_expression():
-    code = "1 + 1"
+@pytest.mark.parametrize("code, expected", [
+    ("1 + 1", ["__last_res__ = 1 + 1", "if __last_res__ is not None:", "print(repr(__last_res__))"]),
+    ("x = 10\ny = 20\nx + y", ["x = 10", "y = 20", "__last_res__ = x + y", "print(repr(__last_res__))"]),
+    # print() returns None, so __last_res__ will be None, and it won't be printed again
+    ("print('hello')", ["__last_res__ = print('hello')", "if __last_res__ is not None:"]),
+], ids=["expression", "multiline", "already_printing"])
+def test_wrap_code_wraps_last_expression(code, expected):
     wrapped = main.wrap_code(code)
-    assert "__last_res__ = 1 + 1" in wrapped
-    assert "if __last_res__ is not None:" in wrapped
-    assert "print(repr(__last_res__))" in wrapped
+    for fragment in expected:
+        assert fragment in wrapped
 
-def test_wrap_code_multiline_expression():
-    code = "x = 10\ny = 20\nx + y"
-    wrapped = main.wrap_code(code)
-    assert "x = 10" in wrapped
-    assert "y = 20" in wrapped
-    assert "__last_res__ = x + y" in wrapped
-    assert "print(repr(__last_res__))" in wrapped
+@pytest.mark.parametrize("code", [
+    "x = 1",    # Assignment is not an expression, so it should NOT be wrapped
+    "if x =",   # Syntax errors are left for the interpreter to report
+], ids=["assignment", "syntax_error"])
+def test_wrap_code_leaves_code_unchanged(code):
+    assert main.wrap_code(code) == code
 
-def test_wrap_code_already_printing():
-    code = "print('hello')"
-    wrapped = main.wrap_code(code)
-    # print() returns None, so __last_res__ will be None,
-    # and it won't be printed again.
-    assert "__last_res__ = print('hello')" in wrapped
-    assert "if __last_res__ is not None:" in wrapped
+def test_wrap_code_is_memoized():
+    main._wrap_code_cached.cache_clear()
+    code = "2 * 21"
+    first = main.wrap_code(code)
+    assert main.wrap_code(code) == first
+    assert main._wrap_code_cached.cache_info().hits == 1
 
-def test_wrap_code_assignment():
-    code = "x = 1"
-    wrapped = main.wrap_code(code)
-    # Assignment is not an expression, so it should NOT be wrapped
-    assert wrapped == code
+def test_wrap_code_large_snippet_not_cached():
+    main._wrap_code_cached.cache_clear()
+    code = "x = 1\n" * (main._WRAP_CACHE_MAX_CODE // 6 + 1) + "x"
+    assert "__last_res__ = x" in main.wrap_code(code)
+    assert main._wrap_code_cached.cache_info().currsize == 0
 
-def test_wrap_code_syntax_error():
-    code = "if x ="
+def test_wrap_code_preserves_source_and_line_numbers():
+    code = "# comment\nx = [1,\n     2]  # kept\nlen(x)  # last"
     wrapped = main.wrap_code(code)
-    assert wrapped == code
+    assert wrapped.startswith("# comment\nx = [1,\n     2]  # kept\n__last_res__ = len(x)  # last\n")
+    # The expression stays on its original line, so tracebacks point at the user's code
+    assert wrapped.splitlines()[3].startswith("__last_res__ = len(x)")
+
+def test_wrap_code_expression_after_semicolon():
+    import contextlib, io
+    wrapped = main.wrap_code("x = 'é'; x")
+    assert wrapped.startswith("x = 'é'; __last_res__ = x\n")
+
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        exec(wrapped, {})
+    assert out.getvalue() == "'é'\n"
+
+def test_wrap_code_skips_parse_for_trailing_statement():
+    code = "import math\ndef f(x):\n    return math.sqrt(x)\n# done\n"
+    with patch("main.ast.parse") as parse:
+        assert main._wrap_code(code) == code
+        parse.assert_not_called()
+
+@pytest.mark.parametrize("code", [
+    "import math; math.pi",
+    's = """\nimport x\n"""\ns',
+    "[x\nfor x in range(3)]",
+    "print('a\x0cimport b')",
+    "print('a\u2028import b')",
+])
+def test_wrap_code_ambiguous_tail_still_parsed(code):
+    assert "__last_res__ = " in main._wrap_code(code)
@@ -7,7 +7,12 @@ from docker.errors import NotFound, APIError
 # Note: We use real docker.errors exceptions to ensure compatibility
 # with the except clause in main.py's execute_code method.
 
-def test_execute_code_cleanup_success():
+@pytest.fixture(autouse=True)
+def one_shot_exec():
+    with patch("main.RCE_PYTHON_WORKER", False):
+        yield
+
+def test_execute_code_leaves_no_temp_file():
     km = KernelManager()
     session_id = "test_session"
     code = "print('hello')"
@@ -16,35 +21,21 @@ def test_execute_code_cleanup_success():
     # Mock get_or_create_container to return our mock_container
     km.get_or_create_container = MagicMock(return_value=mock_container)
 
-    # Mock _execute_in_container instead of container.exec_run
     mock_exec_result = MagicMock()
     mock_exec_result.output = (b"hello\n", b"")
     mock_exec_result.exit_code = 0
 
     with patch.object(km, '_execute_in_container', return_value=mock_exec_result) as mock_exec:
-        # Mock uuid to have a predictable filename
-        with patch('main.uuid.uuid4') as mock_uuid:
-            mock_uuid.return_value.hex = "123456"
-            expected_filename = "exec_123456.py"
-            expected_path = f"/mnt/data/{expected_filename}"
-
-            # Execute
-            result = km.execute_code(session_id, code)
-
-            # Assertions
-            assert result["stdout"] == "hello\n"
-            mock_exec.assert_called_once()
+        result = km.execute_code(session_id, code)
 
-            # Verify cleanup was called
-            cleanup_call = None
-            for call in mock_container.exec_run.call_args_list:
-                if call.kwargs.get('cmd') == ["rm", expected_path]:
-                    cleanup_call = call
-                    break
+        assert result["stdout"] == "hello\n"
+        mock_exec.assert_called_once_with(mock_container, main.wrap_code(code))
 
-            assert cleanup_call is not None, f"Cleanup 'rm' command not found in exec_run calls. Expected {expected_path}"
+        # Code is streamed over stdin: nothing is uploaded and no 'rm' exec is issued
+        mock_container.put_archive.assert_not_called()
+        mock_container.exec_run.assert_not_called()
 
-def test_execute_code_cleanup_on_failure():
+def test_execute_code_failure_issues_no_cleanup():
     km = KernelManager()
     session_id = "test_session"
     code = "print('hello')"
@@ -54,27 +45,15 @@ def test_execute_code_cleanup_on_failure():
 
     # Mock _execute_in_container to raise an exception
     with patch.object(km, '_execute_in_container', side_effect=Exception("Execution failed")):
-        with patch('main.uuid.uuid4') as mock_uuid:
-            mock_uuid.return_value.hex = "123456"
-            expected_path = "/mnt/data/exec_123456.py"
-
-            # Execute - should raise HTTPException(500)
-            with pytest.raises(main.HTTPException) as excinfo:
-                km.execute_code(session_id, code)
-
-            assert excinfo.value.status_code == 500
+        # Execute - should raise HTTPException(500)
+        with pytest.raises(main.HTTPException) as excinfo:
+            km.execute_code(session_id, code)
 
-            # Verify cleanup was STILL called despite the exception
-            cleanup_call = None
-            for call in mock_container.exec_run.call_args_list:
-                if call.kwargs.get('cmd') == ["rm", expected_path]:
-                    cleanup_call = call
-                    break
+        assert excinfo.value.status_code == 500
+        mock_container.exec_run.assert_not_called()
 
-            assert cleanup_call is not None, "Cleanup 'rm' command not found in exec_run calls even on failure"
-
-def test_execute_code_cleanup_on_exec_retry():
-    """Test cleanup happens even if the first attempt fails with Docker error and retry is triggered."""
+def test_execute_code_retry_uses_refreshed_container():
+    """Test the retry runs on the refreshed container after a Docker error."""
     km = KernelManager()
     session_id = "test_session"
     code = "print('hello')"
@@ -92,21 +71,10 @@ def test_execute_code_cleanup_on_exec_retry():
 
     # Mock _execute_in_container to fail first then succeed
     with patch.object(km, '_execute_in_container', side_effect=[NotFound("Container gone"), mock_exec_result]) as mock_exec:
-        with patch('main.uuid.uuid4') as mock_uuid:
-            mock_uuid.return_value.hex = "retry_hex"
-            expected_path = "/mnt/data/exec_retry_hex.py"
-
-            # Execute
-            result = km.execute_code(session_id, code)
-
-            assert result["stdout"] == "hello retry\n"
-            assert mock_exec.call_count == 2
-
-            # Verify cleanup was called on the SECOND container (which is what execute_code ends with)
-            cleanup_call = None
-            for call in mock_container2.exec_run.call_args_list:
-                if call.kwargs.get('cmd') == ["rm", expected_path]:
-                    cleanup_call = call
-                    break
+        result = km.execute_code(session_id, code)
 
-            assert cleanup_call is not None, "Cleanup 'rm' command not found on the retry container"
+        assert result["stdout"] == "hello retry\n"
+        assert mock_exec.call_count == 2
+        assert mock_exec.call_args_list[1].args[0] is mock_container2
+        mock_container1.exec_run.assert_not_called()
+        mock_container2.exec_run.assert_not_called()
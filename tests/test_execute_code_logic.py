@@ -3,14 +3,21 @@ from unittest.mock import MagicMock, patch, ANY
 import main
 from main import KernelManager
 from docker.errors import NotFound, APIError
-import io
-import tarfile
+import socket
+import struct
+import threading
 
 @pytest.fixture
 def kernel_manager():
     km = KernelManager()
     return km
 
+@pytest.fixture(autouse=True)
+def one_shot_exec():
+    """These tests cover the one-shot 'python3 -' path; the worker has its own tests."""
+    with patch("main.RCE_PYTHON_WORKER", False):
+        yield
+
 def test_execute_code_happy_path(kernel_manager):
     session_id = "test_session"
     code = "1 + 1"
@@ -32,8 +39,8 @@ def test_execute_code_happy_path(kernel_manager):
 
             mock_wrap.assert_called_once_with(code)
             mock_exec.assert_called_once()
-            # Verify cleanup
-            mock_container.exec_run.assert_called_with(cmd=["rm", ANY])
+            # No temp file is written, so there is no cleanup exec
+            mock_container.exec_run.assert_not_called()
 
 def test_execute_code_retry_on_not_found(kernel_manager):
     session_id = "test_session"
@@ -58,8 +65,9 @@ def test_execute_code_retry_on_not_found(kernel_manager):
         # Verify get_or_create_container was called with force_refresh=True for retry
         kernel_manager.get_or_create_container.assert_any_call(session_id, force_refresh=True)
 
-        # Verify cleanup on second container
-        mock_container2.exec_run.assert_called_with(cmd=["rm", ANY])
+        # No cleanup exec is needed on either container
+        mock_container1.exec_run.assert_not_called()
+        mock_container2.exec_run.assert_not_called()
 
 def test_execute_code_retry_on_api_error(kernel_manager):
     session_id = "test_session"
@@ -79,8 +87,9 @@ def test_execute_code_retry_on_api_error(kernel_manager):
         assert result["stdout"] == "api retry success\n"
         assert mock_exec.call_count == 2
 
-        # Verify cleanup on second container
-        mock_container2.exec_run.assert_called_with(cmd=["rm", ANY])
+        # No cleanup exec is needed on either container
+        mock_container1.exec_run.assert_not_called()
+        mock_container2.exec_run.assert_not_called()
 
 def test_execute_code_exhausted_retry(kernel_manager):
     session_id = "test_session"
@@ -98,38 +107,112 @@ def test_execute_code_exhausted_retry(kernel_manager):
         assert excinfo.value.status_code == 500
         assert mock_exec.call_count == 2
 
-        # Verify cleanup on second container
-        mock_container2.exec_run.assert_called_with(cmd=["rm", ANY])
+        # No cleanup exec is needed on either container
+        mock_container1.exec_run.assert_not_called()
+        mock_container2.exec_run.assert_not_called()
+
+@pytest.mark.parametrize("output_format, data, expected", [
+    ("text", b"caf\xc3\xa9\n", {"stdout": "caf\u00e9\n"}),
+    ("text", b"\xff\n", {"stdout": "\ufffd\n"}),
+    ("bytes", b"\x00\x01", {"stdout": "", "stdout_b64": "AAE="}),
+    ("auto", b"small", {"stdout": "small"}),
+    ("auto", None, {"stdout": ""}),
+])
+def test_format_output(output_format, data, expected):
+    assert main.format_output("stdout", data, output_format) == expected
+
+def test_format_output_auto_encodes_large_output():
+    with patch("main.RCE_TEXT_OUTPUT_LIMIT", 4):
+        assert main.format_output("stderr", b"12345", "auto") == {"stderr": "", "stderr_b64": "MTIzNDU="}
+
+def _frame(stream_id, payload):
+    return struct.pack(">BxxxL", stream_id, len(payload)) + payload
 
 def test_execute_in_container_logic(kernel_manager):
     mock_container = MagicMock()
+    mock_container.id = "container_id"
+    api = mock_container.client.api
+    api.exec_create.return_value = {"Id": "exec_id"}
+    api.exec_inspect.return_value = {"ExitCode": 0}
+
+    # Simulate the hijacked exec connection with a local socket pair
+    client_sock, daemon_sock = socket.socketpair()
+    api.exec_start.return_value = client_sock
+
     code_content = "print('hello')"
-    path = "/mnt/data/exec_123.py"
-    filename = "exec_123.py"
+    daemon_sock.sendall(_frame(1, b"hello\n") + _frame(2, b"warn\n"))
+    daemon_sock.shutdown(socket.SHUT_WR)
 
-    mock_res = MagicMock()
-    mock_container.exec_run.return_value = mock_res
-
-    res = kernel_manager._execute_in_container(mock_container, code_content, path, filename)
-
-    assert res == mock_res
-
-    # Verify put_archive was called
-    mock_container.put_archive.assert_called_once()
-    args, _ = mock_container.put_archive.call_args
-    assert args[0] == "/mnt/data"
-
-    # Verify the content of the tar
-    tar_data = args[1]
-    with tarfile.open(fileobj=io.BytesIO(tar_data), mode='r') as tar:
-        member = tar.getmember(filename)
-        assert member.size == len(code_content.encode('utf-8'))
-        f = tar.extractfile(member)
-        assert f.read().decode('utf-8') == code_content
-
-    # Verify exec_run was called with correct arguments
-    mock_container.exec_run.assert_called_once_with(
-        cmd=["python3", path],
-        workdir="/mnt/data",
-        demux=True
+    res = kernel_manager._execute_in_container(mock_container, code_content)
+
+    assert res.exit_code == 0
+    assert res.output == (b"hello\n", b"warn\n")
+
+    # Code is piped into 'python3 -' instead of being uploaded with put_archive
+    mock_container.put_archive.assert_not_called()
+    api.exec_create.assert_called_once_with(
+        "container_id",
+        cmd=["python3", "-"],
+        stdin=True,
+        workdir="/mnt/data"
     )
+    api.exec_start.assert_called_once_with("exec_id", socket=True)
+    api.exec_inspect.assert_called_once_with("exec_id")
+
+def test_execute_in_container_sends_code_on_stdin(kernel_manager):
+    mock_container = MagicMock()
+    api = mock_container.client.api
+    api.exec_create.return_value = {"Id": "exec_id"}
+    api.exec_inspect.return_value = {"ExitCode": 1}
+
+    client_sock, daemon_sock = socket.socketpair()
+    api.exec_start.return_value = client_sock
+
+    code_content = "print('日本語')"
+    received = []
+
+    def daemon():
+        data = b""
+        while chunk := daemon_sock.recv(4096):
+            data += chunk
+        received.append(data)
+        daemon_sock.close()
+
+    t = threading.Thread(target=daemon)
+    t.start()
+    res = kernel_manager._execute_in_container(mock_container, code_content)
+    t.join()
+
+    # stdin is half-closed after the code so the interpreter sees EOF
+    assert received == [code_content.encode("utf-8")]
+    assert res.exit_code == 1
+    assert res.output == (None, None)
+
+def test_execute_code_stream_yields_frames_as_they_arrive(kernel_manager):
+    mock_container = MagicMock()
+    api = mock_container.client.api
+    api.exec_create.return_value = {"Id": "exec_id"}
+    api.exec_inspect.return_value = {"ExitCode": 0}
+    kernel_manager.get_or_create_container = MagicMock(return_value=mock_container)
+
+    client_sock, daemon_sock = socket.socketpair()
+    api.exec_start.return_value = client_sock
+
+    chunks = kernel_manager.execute_code_stream("test_session", "print('a')")
+    daemon_sock.sendall(_frame(1, b"a\n"))
+    # The first frame is available before the process has finished
+    assert next(chunks) == ("stdout", b"a\n")
+
+    daemon_sock.sendall(_frame(2, b"err\n"))
+    daemon_sock.shutdown(socket.SHUT_WR)
+    assert list(chunks) == [("stderr", b"err\n"), ("exit_code", 0)]
+    api.exec_inspect.assert_called_once_with("exec_id")
+
+def test_execute_code_stream_start_failure(kernel_manager):
+    mock_container = MagicMock()
+    mock_container.client.api.exec_create.side_effect = Exception("boom")
+    kernel_manager.get_or_create_container = MagicMock(return_value=mock_container)
+
+    with pytest.raises(main.HTTPException) as excinfo:
+        kernel_manager.execute_code_stream("test_session", "print(1)")
+    assert excinfo.value.status_code == 500
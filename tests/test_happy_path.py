@@ -1,9 +1,8 @@
 from unittest.mock import MagicMock, patch
-from fastapi.testclient import TestClient
 import main
 
 @patch('main.kernel_manager')
-def test_run_code_success(mock_kernel_manager):
+def test_run_code_success(mock_kernel_manager, client):
     # Setup mock for execute_code
     mock_kernel_manager.execute_code.return_value = {
         "stdout": "hello world\n",
@@ -19,8 +18,7 @@ def test_run_code_success(mock_kernel_manager):
     mock_kernel_manager.session_to_nanoid = {}
     mock_kernel_manager.nanoid_to_session = {}
     mock_kernel_manager.file_id_map = {}
-
-    client = TestClient(main.app)
+    mock_kernel_manager.file_name_to_id = {}
 
     response = client.post(
         "/run/exec",
@@ -1,21 +1,15 @@
+import os
 import pytest
 import time
 import io
 import tarfile
 from unittest.mock import MagicMock, patch
-from docker.errors import NotFound
+from docker.errors import APIError, NotFound
 from fastapi import HTTPException
 import main
 from main import KernelManager
 
-@pytest.fixture(autouse=True)
-def mock_docker_client():
-    """Replace main.DOCKER_CLIENT with a MagicMock for each test."""
-    mock_client = MagicMock()
-    original = main.DOCKER_CLIENT
-    main.DOCKER_CLIENT = mock_client
-    yield mock_client
-    main.DOCKER_CLIENT = original
+pytestmark = pytest.mark.usefixtures("mock_docker_client")
 
 @pytest.fixture
 def kernel_manager():
@@ -59,6 +53,23 @@ def test_get_or_create_container_stopped(kernel_manager):
     mock_container.reload.assert_called_once()
     mock_container.start.assert_called_once()
 
+def test_get_or_create_container_keeps_session_on_daemon_error(kernel_manager):
+    session_id = "test_session"
+    mock_container = MagicMock()
+    mock_container.reload.side_effect = APIError("Internal error", response=MagicMock(status_code=500))
+    kernel_manager.active_kernels[session_id] = {
+        "container": mock_container,
+        "last_accessed": time.time()
+    }
+    kernel_manager.start_new_container_unlocked = MagicMock()
+
+    with pytest.raises(HTTPException) as excinfo:
+        kernel_manager.get_or_create_container(session_id, force_refresh=True)
+
+    assert excinfo.value.status_code == 503
+    assert kernel_manager.active_kernels[session_id]["container"] is mock_container
+    kernel_manager.start_new_container_unlocked.assert_not_called()
+
 def test_get_or_create_container_missing_during_reload(kernel_manager):
     # Setup
     session_id = "test_session"
@@ -83,6 +94,38 @@ def test_get_or_create_container_missing_during_reload(kernel_manager):
     assert container == new_container
     kernel_manager.start_new_container_unlocked.assert_called_once_with(session_id)
 
+def test_get_or_create_container_replaces_container_that_fails_to_start(kernel_manager):
+    session_id = "test_session"
+    old_container = MagicMock()
+    old_container.status = "exited"
+    old_container.start.side_effect = APIError("Mount source missing", response=MagicMock(status_code=500))
+    kernel_manager.active_kernels[session_id] = {"container": old_container, "last_accessed": time.time()}
+    new_container = MagicMock()
+    kernel_manager.start_new_container_unlocked = MagicMock(return_value=new_container)
+
+    assert kernel_manager.get_or_create_container(session_id, force_refresh=True) is new_container
+    kernel_manager.start_new_container_unlocked.assert_called_once_with(session_id)
+
+@pytest.mark.parametrize("reload_error", [
+    NotFound("Gone"),
+    APIError("Conflict", response=MagicMock(status_code=409)),
+    RuntimeError("boom"),
+], ids=["not_found", "client_error", "other"])
+def test_replaced_container_releases_its_worker(kernel_manager, reload_error):
+    session_id = "test_session"
+    old_container = MagicMock()
+    old_container.id = "old_id"
+    old_container.reload.side_effect = reload_error
+    worker = MagicMock()
+    kernel_manager.workers["old_id"] = worker
+    kernel_manager.active_kernels[session_id] = {"container": old_container, "last_accessed": time.time()}
+    kernel_manager.start_new_container_unlocked = MagicMock(return_value=MagicMock())
+
+    kernel_manager.get_or_create_container(session_id, force_refresh=True)
+
+    assert "old_id" not in kernel_manager.workers
+    worker.close.assert_called_once()
+
 def test_start_new_container_success(kernel_manager):
     session_id = "new_session"
     mock_container = MagicMock()
@@ -96,6 +139,23 @@ def test_start_new_container_success(kernel_manager):
     main.DOCKER_CLIENT.containers.run.assert_called_once()
     args, kwargs = main.DOCKER_CLIENT.containers.run.call_args
     assert kwargs["environment"] == {"PYTHONUNBUFFERED": "1"}
+    assert kwargs["tmpfs"] == {}
+    assert kwargs["runtime"] is None
+    mock_container.exec_run.assert_not_called()
+
+def test_start_new_container_tmpfs_enabled(kernel_manager):
+    with patch.dict(os.environ, {"RCE_TMPFS_SIZE": "64m"}):
+        kernel_manager.start_new_container("with_tmpfs")
+
+    _, kwargs = main.DOCKER_CLIENT.containers.run.call_args
+    assert kwargs["tmpfs"] == {"/tmp": "size=64m,nosuid"}
+
+def test_start_new_container_runtime(kernel_manager):
+    with patch.dict(os.environ, {"RCE_RUNTIME": "runsc"}):
+        kernel_manager.start_new_container("gvisor")
+
+    _, kwargs = main.DOCKER_CLIENT.containers.run.call_args
+    assert kwargs["runtime"] == "runsc"
 
 def test_start_new_container_failure(kernel_manager):
     session_id = "fail_session"
@@ -116,19 +176,40 @@ def test_list_files_success(kernel_manager):
     # Mock ExecResult
     mock_res = MagicMock()
     mock_res.exit_code = 0
-    mock_res.output = b"file1.txt\nfile2.py\n\n"
+    mock_res.output = "file1.txt\0file2.py\0データ.csv\0".encode("utf-8")
     mock_container.exec_run.return_value = mock_res
 
     # Execute
     files = kernel_manager.list_files(session_id)
 
     # Assert
-    assert files == ["file1.txt", "file2.py"]
+    assert files == ["file1.txt", "file2.py", "データ.csv"]
     kernel_manager.get_or_create_container.assert_called_once_with(session_id)
     mock_container.exec_run.assert_called_once_with(
-        cmd=["python3", "-c", "import os; print('\\n'.join(os.listdir('/mnt/data')))"]
+        cmd=["find", "/mnt/data", "-mindepth", "1", "-maxdepth", "1", "-type", "f", "-printf", "%f\\0"]
     )
 
+def test_list_files_replaces_undecodable_names(kernel_manager):
+    mock_container = MagicMock()
+    mock_container.exec_run.return_value = MagicMock(exit_code=0, output=b"ok.txt\0bad\xff.txt\0")
+    kernel_manager.get_or_create_container = MagicMock(return_value=mock_container)
+
+    assert kernel_manager.list_files("test_session") == ["ok.txt", "bad\ufffd.txt"]
+
+def test_list_files_volume_reads_directory(kernel_manager, tmp_path):
+    session_dir = tmp_path / "sess"
+    session_dir.mkdir()
+    (session_dir / "a.csv").write_text("x")
+    (session_dir / "subdir").mkdir()
+    os.symlink("/etc/passwd", session_dir / "link")
+    kernel_manager.get_or_create_container = MagicMock()
+
+    with patch("main.RCE_DATA_DIR_HOST", str(tmp_path)), patch("main.RCE_DATA_DIR_INTERNAL", str(tmp_path)):
+        assert kernel_manager.list_files("sess") == ["a.csv"]
+        assert kernel_manager.list_files("missing") == []
+
+    kernel_manager.get_or_create_container.assert_not_called()
+
 def test_list_files_failure(kernel_manager):
     # Setup
     session_id = "test_session"
@@ -148,15 +229,24 @@ def test_list_files_failure(kernel_manager):
     kernel_manager.get_or_create_container.assert_called_once_with(session_id)
     mock_container.exec_run.assert_called_once()
 
+def test_list_files_refreshes_container_once_on_docker_error(kernel_manager):
+    stale, fresh = MagicMock(), MagicMock()
+    stale.exec_run.side_effect = NotFound("gone")
+    fresh.exec_run.return_value = MagicMock(exit_code=0, output=b"a.txt\0")
+    kernel_manager.get_or_create_container = MagicMock(side_effect=[stale, fresh])
+
+    assert kernel_manager.list_files("test_session") == ["a.txt"]
+    assert kernel_manager.get_or_create_container.call_args_list[1].kwargs == {"force_refresh": True}
+
 def test_recover_containers_success(kernel_manager):
     # Setup
     mock_container1 = MagicMock()
     mock_container1.id = "c1"
-    mock_container1.labels = {"session_id": "s1"}
+    mock_container1.attrs = {"Labels": {"session_id": "s1"}}
 
     mock_container2 = MagicMock()
     mock_container2.id = "c2"
-    mock_container2.labels = {"session_id": "s2"}
+    mock_container2.attrs = {"Labels": {"session_id": "s2"}}
 
     main.DOCKER_CLIENT.containers.list.return_value = [mock_container1, mock_container2]
 
@@ -170,7 +260,8 @@ def test_recover_containers_success(kernel_manager):
     assert kernel_manager.active_kernels["s2"]["container"] == mock_container2
     main.DOCKER_CLIENT.containers.list.assert_called_once_with(
         all=True,
-        filters={"label": f"managed_by={main.RCE_MANAGED_BY_VALUE}"}
+        filters={"label": f"managed_by={main.RCE_MANAGED_BY_VALUE}"},
+        sparse=True
     )
 
 def test_recover_containers_list_failure(kernel_manager):
@@ -210,11 +301,11 @@ def test_recover_containers_inner_failure(kernel_manager):
     # Setup
     mock_container1 = MagicMock()
     mock_container1.id = "c1"
-    mock_container1.labels = {"session_id": "s1"}
+    mock_container1.attrs = {"Labels": {"session_id": "s1"}}
 
     mock_container2 = MagicMock()
     mock_container2.id = "c2"
-    mock_container2.labels = {"session_id": "s2"}
+    mock_container2.attrs = {"Labels": {"session_id": "s2"}}
 
     main.DOCKER_CLIENT.containers.list.return_value = [mock_container1, mock_container2]
 
@@ -238,11 +329,11 @@ def test_recover_containers_inner_failure(kernel_manager):
 def test_recover_containers_skips(kernel_manager):
     # Setup
     mock_container_no_id = MagicMock()
-    mock_container_no_id.labels = {} # No session_id
+    mock_container_no_id.attrs = {"Labels": {}} # No session_id
 
     mock_container_exists = MagicMock()
     mock_container_exists.id = "exists"
-    mock_container_exists.labels = {"session_id": "existing_session"}
+    mock_container_exists.attrs = {"Labels": {"session_id": "existing_session"}}
 
     kernel_manager.active_kernels["existing_session"] = {"container": MagicMock()}
 
@@ -257,20 +348,106 @@ def test_recover_containers_skips(kernel_manager):
         recovered_calls = [call for call in mock_logger.info.call_args_list if "Recovered session" in call.args[0]]
         assert len(recovered_calls) == 0
 
+def test_upload_file_put_archive(kernel_manager):
+    mock_container = MagicMock()
+    kernel_manager.get_or_create_container = MagicMock(return_value=mock_container)
+
+    with patch("main.RCE_DATA_DIR_HOST", None):
+        kernel_manager.upload_file("test_session", "../data.csv", b"a,b\n1,2\n")
+
+    mock_container.put_archive.assert_called_once()
+    path, data = mock_container.put_archive.call_args.args
+    assert path == "/mnt/data"
+    with tarfile.open(fileobj=io.BytesIO(b"".join(data)), mode='r') as tar:
+        member = tar.getmember("data.csv")
+        assert tar.extractfile(member).read() == b"a,b\n1,2\n"
+
+def test_upload_files_single_put_archive(kernel_manager):
+    mock_container = MagicMock()
+    kernel_manager.get_or_create_container = MagicMock(return_value=mock_container)
+
+    with patch("main.RCE_DATA_DIR_HOST", None):
+        kernel_manager.upload_files("test_session", [("a.txt", io.BytesIO(b"A")), ("b.txt", io.BytesIO(b"BB"))])
+
+    # All files travel in one archive
+    mock_container.put_archive.assert_called_once()
+    _, data = mock_container.put_archive.call_args.args
+    with tarfile.open(fileobj=io.BytesIO(b"".join(data)), mode='r') as tar:
+        assert tar.getnames() == ["a.txt", "b.txt"]
+        assert tar.extractfile("b.txt").read() == b"BB"
+
+def test_upload_files_streams_archive_in_chunks(kernel_manager):
+    mock_container = MagicMock()
+    kernel_manager.get_or_create_container = MagicMock(return_value=mock_container)
+    content = os.urandom(main.STREAM_CHUNK_SIZE * 2 + 7)
+
+    with patch("main.RCE_DATA_DIR_HOST", None):
+        kernel_manager.upload_files("test_session", [("big.bin", io.BytesIO(content))])
+
+    _, data = mock_container.put_archive.call_args.args
+    pieces = list(data)
+    assert max(len(p) for p in pieces) <= main.STREAM_CHUNK_SIZE
+    archive = b"".join(pieces)
+    assert len(archive) % tarfile.BLOCKSIZE == 0
+    with tarfile.open(fileobj=io.BytesIO(archive), mode='r') as tar:
+        assert tar.extractfile("big.bin").read() == content
+
+def test_upload_files_retry_resends_whole_archive(kernel_manager):
+    stale, fresh = MagicMock(), MagicMock()
+
+    def fail_midway(path, data):
+        next(data)
+        raise NotFound("gone")
+
+    stale.put_archive.side_effect = fail_midway
+    kernel_manager.get_or_create_container = MagicMock(side_effect=[stale, fresh])
+
+    with patch("main.RCE_DATA_DIR_HOST", None):
+        kernel_manager.upload_file("test_session", "data.csv", b"a,b\n")
+
+    _, data = fresh.put_archive.call_args.args
+    with tarfile.open(fileobj=io.BytesIO(b"".join(data)), mode='r') as tar:
+        assert tar.extractfile("data.csv").read() == b"a,b\n"
+
+@pytest.mark.parametrize("name,size", [
+    ("data.csv", 0),
+    ("data.csv", 1234),
+    ("x" * 100, 512),
+    ("x" * 101, 1),          # too long for ustar: PAX fallback
+    ("データ.csv", 3),       # non-ASCII: PAX fallback
+])
+def test_tar_header_matches_tarfile(name, size):
+    tar_info = tarfile.TarInfo(name=name)
+    tar_info.size = size
+    assert main._tar_header(name, size) == tar_info.tobuf()
+
+def test_upload_files_volume_copies_stream(kernel_manager, tmp_path):
+    kernel_manager.get_or_create_container = MagicMock()
+    fileobj = io.BytesIO(b"payload")
+    fileobj.read()  # a consumed stream is rewound before copying
+
+    with patch("main.RCE_DATA_DIR_HOST", str(tmp_path)), patch("main.RCE_DATA_DIR_INTERNAL", str(tmp_path)):
+        kernel_manager.upload_files("sess", [("data.bin", fileobj)])
+
+    assert (tmp_path / "sess" / "data.bin").read_bytes() == b"payload"
+
 def test_download_file_invalid_filename(kernel_manager):
     with pytest.raises(HTTPException) as excinfo:
         kernel_manager.download_file("session_id", "")
     assert excinfo.value.status_code == 400
 
-def test_download_file_volume_success(kernel_manager):
+def test_download_file_volume_success(kernel_manager, tmp_path):
+    session_dir = tmp_path / "test_session"
+    session_dir.mkdir()
+    (session_dir / "test.txt").write_bytes(b"content")
+    os.utime(session_dir / "test.txt", (123456789.0, 123456789.0))
+
     with patch("main.RCE_DATA_DIR_HOST", "/host/path"), \
-         patch("main.RCE_DATA_DIR_INTERNAL", "/internal/path"), \
-         patch("os.path.exists", return_value=True), \
-         patch("os.path.getmtime", return_value=123456789.0), \
-         patch("builtins.open", MagicMock(return_value=MagicMock(__enter__=MagicMock(return_value=MagicMock(read=MagicMock(return_value=b"content")))))):
+         patch("main.RCE_DATA_DIR_INTERNAL", str(tmp_path)):
 
-        content, mtime = kernel_manager.download_file("test_session", "test.txt")
-        assert content == b"content"
+        chunks, size, mtime = kernel_manager.download_file("test_session", "test.txt")
+        assert b"".join(chunks) == b"content"
+        assert size == 7
         assert mtime == 123456789.0
 
 def test_download_file_volume_not_found(kernel_manager):
@@ -299,9 +476,11 @@ def test_download_file_docker_success(kernel_manager):
     mock_container.get_archive.return_value = ([tar_stream.getvalue()], {"mtime": 987654321.0})
 
     with patch("main.RCE_DATA_DIR_HOST", None):
-        res_content, mtime = kernel_manager.download_file(session_id, filename)
-        assert res_content == content
+        chunks, size, mtime = kernel_manager.download_file(session_id, filename)
+        assert b"".join(chunks) == content
+        assert size == len(content)
         assert mtime == 987654321.0
+        mock_container.get_archive.assert_called_once_with(f"/mnt/data/{filename}", encode_stream=False)
 
 def test_download_file_docker_not_found(kernel_manager):
     session_id = "test_session"
@@ -316,6 +495,19 @@ def test_download_file_docker_not_found(kernel_manager):
             kernel_manager.download_file(session_id, filename)
         assert excinfo.value.status_code == 404
 
+def test_download_missing_file_does_not_refresh_container(kernel_manager):
+    mock_container = MagicMock()
+    mock_container.get_archive.side_effect = NotFound("no such file")
+    kernel_manager.get_or_create_container = MagicMock(return_value=mock_container)
+
+    with patch("main.RCE_DATA_DIR_HOST", None):
+        with pytest.raises(HTTPException) as excinfo:
+            kernel_manager.download_file("test_session", "missing.txt")
+
+    assert excinfo.value.status_code == 404
+    kernel_manager.get_or_create_container.assert_called_once_with("test_session")
+    mock_container.get_archive.assert_called_once()
+
 def test_download_file_docker_empty_tar(kernel_manager):
     session_id = "test_session"
     filename = "test.txt"
@@ -333,3 +525,29 @@ def test_download_file_docker_empty_tar(kernel_manager):
         with pytest.raises(HTTPException) as excinfo:
             kernel_manager.download_file(session_id, filename)
         assert excinfo.value.status_code == 404
+
+def test_download_file_docker_streams_in_chunks(kernel_manager):
+    session_id = "test_session"
+    filename = "big.bin"
+    mock_container = MagicMock()
+    kernel_manager.get_or_create_container = MagicMock(return_value=mock_container)
+
+    content = os.urandom(main.STREAM_CHUNK_SIZE * 3 + 123)
+    tar_stream = io.BytesIO()
+    with tarfile.open(fileobj=tar_stream, mode='w') as tar:
+        tar_info = tarfile.TarInfo(name=filename)
+        tar_info.size = len(content)
+        tar.addfile(tar_info, io.BytesIO(content))
+    raw = tar_stream.getvalue()
+
+    # Deliver the archive in odd-sized pieces, like a socket would
+    pieces = [raw[i:i + 1000] for i in range(0, len(raw), 1000)]
+    mock_container.get_archive.return_value = (iter(pieces), {"mtime": 1})
+
+    with patch("main.RCE_DATA_DIR_HOST", None):
+        chunks, size, _ = kernel_manager.download_file(session_id, filename)
+        received = list(chunks)
+
+    assert size == len(content)
+    assert b"".join(received) == content
+    assert max(len(c) for c in received) <= main.STREAM_CHUNK_SIZE
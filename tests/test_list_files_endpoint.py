@@ -1,11 +1,8 @@
 from unittest.mock import patch
-from fastapi.testclient import TestClient
-from main import app, API_KEY
-
-client = TestClient(app)
+from main import API_KEY
 
 @patch("main.kernel_manager.list_files")
-def test_list_files_success(mock_list_files):
+def test_list_files_success(mock_list_files, client):
     # Mock return value for list_files
     expected_files = ["data.csv", "script.py", "output/results.json"]
     mock_list_files.return_value = expected_files
@@ -27,7 +24,7 @@ def test_list_files_success(mock_list_files):
     mock_list_files.assert_called_once_with(session_id)
 
 @patch("main.kernel_manager.list_files")
-def test_list_files_unauthorized(mock_list_files):
+def test_list_files_unauthorized(mock_list_files, client):
     session_id = "test_session_123"
     response = client.get(
         f"/files/{session_id}",
@@ -36,7 +33,7 @@ def test_list_files_unauthorized(mock_list_files):
     assert response.status_code == 401
 
 @patch("main.kernel_manager.list_files")
-def test_list_files_empty(mock_list_files):
+def test_list_files_empty(mock_list_files, client):
     # Mock return value for an empty session
     mock_list_files.return_value = []
 
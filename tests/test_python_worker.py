@@ -0,0 +1,218 @@
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import pytest
+from unittest.mock import MagicMock, patch
+from docker.errors import NotFound
+import main
+from main import KernelManager, _PythonWorker
+
+@pytest.fixture
+def worker_process(tmp_path):
+    """Runs the worker source locally, as 'docker exec' would inside the sandbox."""
+    proc = subprocess.Popen(
+        [sys.executable, "-u", "-c", main._WORKER_SOURCE],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        cwd=tmp_path
+    )
+    yield proc
+    proc.stdin.close()
+    proc.wait(timeout=5)
+
+def run_cell(proc, code, list_files=False):
+    payload = code.encode("utf-8")
+    proc.stdin.write(struct.pack(">?I", list_files, len(payload)) + payload)
+    proc.stdin.flush()
+    exit_code, stdout_len, stderr_len, files_len = struct.unpack(">BIII", proc.stdout.read(13))
+    stdout, stderr, files = proc.stdout.read(stdout_len), proc.stdout.read(stderr_len), proc.stdout.read(files_len)
+    if list_files:
+        return exit_code, stdout, stderr, files
+    assert files == b""
+    return exit_code, stdout, stderr
+
+def test_worker_runs_cells(worker_process):
+    assert run_cell(worker_process, main.wrap_code("1 + 1")) == (0, b"2\n", b"")
+    assert run_cell(worker_process, "import sys; print('err', file=sys.stderr)") == (0, b"", b"err\n")
+
+def test_worker_uses_fresh_globals_per_cell(worker_process):
+    run_cell(worker_process, "x = 1")
+    exit_code, _, stderr = run_cell(worker_process, "print(x)")
+
+    assert exit_code == 1
+    assert b"NameError" in stderr
+
+def test_worker_reports_errors_like_python(worker_process):
+    exit_code, _, stderr = run_cell(worker_process, "1 / 0")
+    assert exit_code == 1
+    assert stderr.startswith(b"Traceback")
+    assert b'File "<stdin>", line 1' in stderr
+    assert b"<string>" not in stderr  # the worker's own frame is hidden
+
+    exit_code, _, stderr = run_cell(worker_process, "def f(:")
+    assert exit_code == 1
+    assert b"SyntaxError" in stderr
+
+    assert run_cell(worker_process, "import sys; sys.exit(3)")[0] == 3
+    assert run_cell(worker_process, "import sys; sys.exit()")[0] == 0
+
+def test_worker_captures_subprocess_output_and_resets_cwd(worker_process, tmp_path):
+    (tmp_path / "sub").mkdir()
+    run_cell(worker_process, "import os; os.chdir('sub')")
+    exit_code, stdout, _ = run_cell(worker_process, "import os; os.system('echo hi'); print(os.getcwd())")
+
+    assert exit_code == 0
+    assert stdout == f"hi\n{tmp_path}\n".encode()
+
+def test_worker_resets_process_state_between_cells(worker_process):
+    run_cell(worker_process, "import os, sys; os.environ['LEAK'] = '1'; sys.path.append('/leak')")
+    exit_code, stdout, _ = run_cell(worker_process, "import os, sys; print(os.environ.get('LEAK'), '/leak' in sys.path)")
+
+    assert exit_code == 0
+    assert stdout == b"None False\n"
+
+def test_worker_finishes_cell_like_interpreter_shutdown(worker_process):
+    code = (
+        "import atexit, threading, time\n"
+        "atexit.register(print, 'atexit')\n"
+        "threading.Thread(target=lambda: (time.sleep(0.2), print('thread'))).start()\n"
+    )
+    assert run_cell(worker_process, code) == (0, b"thread\natexit\n", b"")
+    # Handlers run once, not again after the next cell
+    assert run_cell(worker_process, "pass") == (0, b"", b"")
+
+def test_worker_closes_pyplot_figures(worker_process):
+    fake_pyplot = (
+        "import sys, types\n"
+        "plt = types.ModuleType('matplotlib.pyplot')\n"
+        "plt.closed = []\n"
+        "plt.close = plt.closed.append\n"
+        "sys.modules['matplotlib.pyplot'] = plt\n"
+    )
+    run_cell(worker_process, fake_pyplot)
+    assert run_cell(worker_process, "import sys; print(sys.modules['matplotlib.pyplot'].closed)") == (0, b"['all']\n", b"")
+
+def test_worker_lists_workspace_on_request(worker_process, tmp_path):
+    (tmp_path / "sub").mkdir()
+    code = "open('out.csv', 'w').close(); import os; os.symlink('/etc/passwd', 'link')"
+    exit_code, _, _, files = run_cell(worker_process, code, list_files=True)
+
+    assert exit_code == 0
+    assert files == b"out.csv"
+
+def _frame(stream_id, payload):
+    return struct.pack(">BxxxL", stream_id, len(payload)) + payload
+
+def test_python_worker_client_reads_framed_reply():
+    container = MagicMock()
+    api = container.client.api
+    api.exec_create.return_value = {"Id": "exec_id"}
+    client_sock, daemon_sock = socket.socketpair()
+    api.exec_start.return_value = client_sock
+
+    worker = _PythonWorker(container)
+    assert worker.is_alive()
+
+    reply = struct.pack(">BIII", 0, 3, 0, 7) + b"ok\na.csv\0b"
+    # Split the reply across frames and interleave worker stderr, which is ignored
+    daemon_sock.sendall(_frame(1, reply[:5]) + _frame(2, b"noise") + _frame(1, reply[5:]))
+    result, files = worker.run("print('ok')", list_files=True)
+
+    assert result.exit_code == 0
+    assert result.output == (b"ok\n", None)
+    assert files == ["a.csv", "b"]
+    assert daemon_sock.recv(1024) == struct.pack(">?I", True, 11) + b"print('ok')"
+    assert api.exec_create.call_args.kwargs["cmd"][:3] == ["python3", "-u", "-c"]
+
+    daemon_sock.close()
+    assert not worker.is_alive()
+    with pytest.raises(ConnectionError):
+        worker.run("print('again')")
+
+@pytest.fixture
+def kernel_manager():
+    return KernelManager()
+
+def test_worker_is_reused_across_runs(kernel_manager):
+    container = MagicMock(id="c1")
+    fake_worker = MagicMock(lock=threading.Lock())
+    fake_worker.is_alive.return_value = True
+    fake_worker.run.return_value = (main.ExecResult(0, (b"1\n", None)), ["a.csv"])
+
+    with patch("main._PythonWorker", return_value=fake_worker) as worker_cls:
+        kernel_manager._run_code(container, "print(1)")
+        result, files = kernel_manager._run_code(container, "print(1)", list_files=True)
+
+    worker_cls.assert_called_once_with(container)
+    assert fake_worker.run.call_count == 2
+    fake_worker.run.assert_called_with("print(1)", True)
+    assert result.output == (b"1\n", None)
+    assert files == ["a.csv"]
+    assert not fake_worker.lock.locked()
+
+def test_busy_worker_falls_back_to_one_shot(kernel_manager):
+    container = MagicMock(id="c1")
+    busy = MagicMock(lock=threading.Lock())
+    busy.lock.acquire()
+    kernel_manager.workers["c1"] = busy
+
+    with patch.object(kernel_manager, "_execute_in_container", return_value="one-shot") as one_shot:
+        assert kernel_manager._run_code(container, "print(1)") == ("one-shot", None)
+
+    one_shot.assert_called_once_with(container, "print(1)")
+    busy.run.assert_not_called()
+
+def test_dead_worker_is_replaced(kernel_manager):
+    container = MagicMock(id="c1")
+    dead = MagicMock(lock=threading.Lock())
+    dead.is_alive.return_value = False
+    kernel_manager.workers["c1"] = dead
+    fresh = MagicMock(lock=threading.Lock())
+    fresh.run.return_value = (main.ExecResult(0, (None, None)), None)
+
+    with patch("main._PythonWorker", return_value=fresh):
+        kernel_manager._run_code(container, "print(1)")
+
+    dead.close.assert_called_once()
+    fresh.run.assert_called_once_with("print(1)", False)
+    assert kernel_manager.workers["c1"] is fresh
+
+def test_worker_start_failure_falls_back(kernel_manager):
+    container = MagicMock(id="c1")
+    with patch("main._PythonWorker", side_effect=Exception("exec failed")), \
+         patch.object(kernel_manager, "_execute_in_container", return_value="one-shot"):
+        assert kernel_manager._run_code(container, "print(1)") == ("one-shot", None)
+    assert kernel_manager.workers == {}
+
+def test_worker_crash_is_reported_not_retried(kernel_manager):
+    container = MagicMock(id="c1")
+    container.client.api.exec_inspect.return_value = {"ExitCode": 137}
+    crashing = MagicMock(lock=threading.Lock(), exec_id="exec_id")
+    crashing.run.side_effect = ConnectionError("Python worker exited")
+
+    with patch("main._PythonWorker", return_value=crashing), \
+         patch.object(kernel_manager, "_execute_in_container") as one_shot:
+        result, files = kernel_manager._run_code(container, "import os; os._exit(1)", list_files=True)
+
+    one_shot.assert_not_called()
+    assert result.exit_code == 137
+    assert b"exited unexpectedly" in result.output[1]
+    assert files is None
+    assert "c1" not in kernel_manager.workers
+
+def test_worker_crash_with_container_gone_is_not_retried(kernel_manager):
+    container = MagicMock(id="c1")
+    container.client.api.exec_inspect.side_effect = NotFound("No such container")
+    crashing = MagicMock(lock=threading.Lock(), exec_id="exec_id")
+    crashing.run.side_effect = ConnectionError("Python worker exited")
+
+    with patch("main._PythonWorker", return_value=crashing), \
+         patch.object(kernel_manager, "_execute_in_container") as one_shot:
+        result, files = kernel_manager._run_code(container, "import os; os._exit(1)")
+
+    one_shot.assert_not_called()
+    assert result.exit_code == 1
+    assert b"exited unexpectedly" in result.output[1]
+    assert files is None
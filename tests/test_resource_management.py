@@ -1,16 +1,18 @@
 import time
+import threading
 import pytest
 from unittest.mock import MagicMock, patch
 from fastapi import HTTPException
 import main
 from main import KernelManager
 
-@pytest.fixture(autouse=True)
-def cleanup_mocks():
-    """Reset the DOCKER_CLIENT mock before each test."""
-    mock_docker_client = MagicMock()
-    main.DOCKER_CLIENT = mock_docker_client
-    yield mock_docker_client
+pytestmark = pytest.mark.usefixtures("mock_docker_client")
+
+class StubContainer:
+    """Container stand-in for teardown tests, which only stop containers."""
+    def __init__(self, container_id, stop_side_effect=None):
+        self.id = container_id
+        self.stop = MagicMock(side_effect=stop_side_effect)
 
 @pytest.fixture
 def km():
@@ -34,6 +36,65 @@ def test_session_ttl_cleanup(km):
     assert session_id not in km.active_kernels
     mock_container.stop.assert_called_once()
 
+def test_cleanup_skips_session_used_after_scan(km):
+    container = MagicMock()
+    km.active_kernels["busy"] = {"container": container, "last_accessed": time.time() - 4000}
+    real_lock = km.lock
+    scans = []
+
+    class TouchingLock:
+        """Simulates a request reaching the session between the TTL scan and the eviction."""
+        def __enter__(self):
+            real_lock.acquire()
+            scans.append(1)
+            if len(scans) == 2:
+                km.active_kernels["busy"]["last_accessed"] = time.time()
+        def __exit__(self, *exc):
+            real_lock.release()
+
+    km.lock = TouchingLock()
+    km.cleanup_sessions()
+
+    assert "busy" in km.active_kernels
+    container.stop.assert_not_called()
+
+def test_fast_path_refreshes_last_accessed(km):
+    container = MagicMock()
+    km.active_kernels["s1"] = {"container": container, "last_accessed": 0}
+
+    assert km.get_or_create_container("s1") is container
+    assert km.active_kernels["s1"]["last_accessed"] > 0
+    container.reload.assert_not_called()
+
+def test_cleanup_drops_mappings_of_sessions_without_container(km):
+    km.session_to_nanoid = {"failed": "nano_failed", "live": "nano_live"}
+    km.nanoid_to_session = {"nano_failed": "failed", "nano_live": "live"}
+    km.file_id_map = {"nano_failed": {"f1": "a.txt"}}
+    km.session_locks = {"failed": threading.Lock()}
+    km.active_kernels["live"] = {"container": MagicMock(), "last_accessed": time.time()}
+
+    # First sweep only marks the orphan; its container could still be starting
+    km.cleanup_sessions()
+    assert "failed" in km.session_to_nanoid
+
+    km.cleanup_sessions()
+    assert km.session_to_nanoid == {"live": "nano_live"}
+    assert km.nanoid_to_session == {"nano_live": "live"}
+    assert km.file_id_map == {}
+    assert km.session_locks == {}
+
+def test_cleanup_keeps_mappings_while_container_is_starting(km):
+    km.session_to_nanoid = {"starting": "nano"}
+    km.nanoid_to_session = {"nano": "starting"}
+    lock = km._session_lock("starting")
+    lock.acquire()
+
+    km.cleanup_sessions()
+    km.cleanup_sessions()
+
+    assert km.session_to_nanoid == {"starting": "nano"}
+    lock.release()
+
 def test_session_limit_enforcement(km):
     # Setup: Fill up to max sessions
     with patch("main.RCE_MAX_SESSIONS", 2):
@@ -47,12 +108,10 @@ def test_session_limit_enforcement(km):
         assert excinfo.value.status_code == 503
         assert "Server is at capacity" in excinfo.value.detail
 
-def test_container_recovery(km, cleanup_mocks):
+def test_container_recovery(km, mock_docker_client):
     # Setup
-    mock_docker_client = cleanup_mocks
     mock_container = MagicMock()
-    mock_container.labels = {"session_id": "recovered_session"}
-    mock_container.status = "exited"
+    mock_container.attrs = {"Labels": {"session_id": "recovered_session"}, "State": "exited"}
     mock_container.id = "cont_id"
     mock_docker_client.containers.list.return_value = [mock_container]
 
@@ -82,9 +141,8 @@ def test_get_or_create_updates_timestamp(km):
     # Assert
     assert km.active_kernels[session_id]["last_accessed"] > initial_time
 
-def test_start_new_container_adds_labels(km, cleanup_mocks):
+def test_start_new_container_adds_labels(km, mock_docker_client):
     # Setup
-    mock_docker_client = cleanup_mocks
     session_id = "labeled_session"
     mock_docker_client.containers.run.return_value = MagicMock()
 
@@ -96,3 +154,160 @@ def test_start_new_container_adds_labels(km, cleanup_mocks):
     assert "labels" in kwargs
     assert kwargs["labels"]["managed_by"] == main.RCE_MANAGED_BY_VALUE
     assert kwargs["labels"]["session_id"] == session_id
+
+def test_concurrent_requests_create_one_container(km, mock_docker_client):
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_run(**kwargs):
+        started.set()
+        release.wait(timeout=5)
+        return MagicMock()
+
+    mock_docker_client.containers.run.side_effect = slow_run
+    results = []
+
+    with patch("main.RCE_DATA_DIR_HOST", None):
+        threads = [threading.Thread(target=lambda: results.append(km.get_or_create_container("same"))) for _ in range(4)]
+        for t in threads:
+            t.start()
+        assert started.wait(timeout=5)
+        # Other sessions are not blocked behind the slow start
+        km.active_kernels["other"] = {"container": MagicMock(), "last_accessed": 0}
+        assert km.get_or_create_container("other") is km.active_kernels["other"]["container"]
+        release.set()
+        for t in threads:
+            t.join(timeout=5)
+
+    assert mock_docker_client.containers.run.call_count == 1
+    assert len(results) == 4
+    assert all(c is results[0] for c in results)
+
+def test_session_limit_counts_starting_containers(km):
+    km._starting = 1
+    with patch("main.RCE_MAX_SESSIONS", 2):
+        km.active_kernels["s1"] = {"container": MagicMock(), "last_accessed": time.time()}
+
+        with pytest.raises(HTTPException) as excinfo:
+            km.start_new_container("s2")
+
+    assert excinfo.value.status_code == 503
+    assert km._starting == 1
+
+def test_session_limit_evicts_least_recently_used(km, mock_docker_client):
+    oldest, older = MagicMock(), MagicMock()
+    with patch("main.RCE_MAX_SESSIONS", 2), patch("main.RCE_EVICT_MIN_IDLE", 60), \
+         patch("main.RCE_DATA_DIR_HOST", None), patch("main.threading.Thread") as thread_cls:
+        km.active_kernels["s1"] = {"container": oldest, "last_accessed": time.time() - 600}
+        km.active_kernels["s2"] = {"container": older, "last_accessed": time.time() - 300}
+        km.session_to_nanoid["s1"] = "nano1"
+        km.nanoid_to_session["nano1"] = "s1"
+
+        km.start_new_container("s3")
+
+    assert set(km.active_kernels) == {"s2", "s3"}
+    assert "nano1" not in km.nanoid_to_session
+    # The evicted container is stopped in the background
+    target = thread_cls.call_args.kwargs["target"]
+    target(*thread_cls.call_args.kwargs["args"])
+    oldest.stop.assert_called_once()
+    older.stop.assert_not_called()
+
+def test_session_limit_never_evicts_running_session(km, mock_docker_client):
+    running, idle = MagicMock(), MagicMock()
+    with patch("main.RCE_MAX_SESSIONS", 2), patch("main.RCE_EVICT_MIN_IDLE", 60), \
+         patch("main.RCE_DATA_DIR_HOST", None), patch("main.threading.Thread"):
+        km.active_kernels["long_exec"] = {"container": running, "last_accessed": time.time() - 600}
+        km.active_kernels["idle"] = {"container": idle, "last_accessed": time.time() - 300}
+        km._begin_work("long_exec")
+
+        km.start_new_container("s3")
+
+    assert set(km.active_kernels) == {"long_exec", "s3"}
+
+def test_execute_code_marks_session_busy_until_done(km):
+    km.active_kernels["s1"] = {"container": MagicMock(), "last_accessed": 0}
+
+    def run(*args):
+        assert km.in_flight == {"s1": 1}
+        return main.ExecResult(0, (b"ok", None)), None
+
+    with patch.object(km, "_run_code", side_effect=run):
+        km.execute_code("s1", "print('ok')")
+
+    assert km.in_flight == {}
+    assert km.active_kernels["s1"]["last_accessed"] > 0
+
+def test_streamed_exec_is_busy_until_iterator_closes(km):
+    km.active_kernels["s1"] = {"container": MagicMock(), "last_accessed": 0}
+    with patch.object(km, "_start_python_exec", return_value=("exec_id", MagicMock())), \
+         patch("main.frames_iter", return_value=iter([(1, b"out")])):
+        chunks = km.execute_code_stream("s1", "print('out')")
+        assert km.in_flight == {"s1": 1}
+        assert next(chunks) == ("stdout", b"out")
+        chunks.close()
+
+    assert km.in_flight == {}
+
+def test_streamed_exec_closed_before_iteration_ends_work(km):
+    km.active_kernels["s1"] = {"container": MagicMock(), "last_accessed": 0}
+    sock = MagicMock()
+    with patch.object(km, "_start_python_exec", return_value=("exec_id", sock)):
+        chunks = km.execute_code_stream("s1", "print('out')")
+        chunks.close()
+
+    assert km.in_flight == {}
+    sock.close.assert_called_once()
+
+def test_teardown_keeps_session_lock_that_is_held(km):
+    lock = km._session_lock("s1")
+    km.active_kernels["s1"] = {"container": MagicMock(), "last_accessed": 0}
+    with lock:
+        with km.lock:
+            km._pop_session_unlocked("s1")
+        assert km._session_lock("s1") is lock
+
+    with km.lock:
+        km._pop_session_unlocked("s1")
+    assert "s1" not in km.session_locks
+
+def test_cleanup_pauses_idle_sessions(km):
+    idle, busy, recent = MagicMock(), MagicMock(), MagicMock()
+    km.active_kernels = {
+        "idle": {"container": idle, "last_accessed": time.time() - 600},
+        "busy": {"container": busy, "last_accessed": time.time() - 600},
+        "recent": {"container": recent, "last_accessed": time.time()},
+    }
+    km._begin_work("busy")
+
+    with patch("main.RCE_SESSION_PAUSE_AFTER", 300):
+        km.cleanup_sessions()
+
+    idle.pause.assert_called_once()
+    busy.pause.assert_not_called()
+    recent.pause.assert_not_called()
+    assert km.active_kernels["idle"]["paused"] is True
+
+def test_paused_session_is_unpaused_on_next_use(km):
+    container = MagicMock()
+    container.status = "paused"
+    km.active_kernels["s1"] = {"container": container, "last_accessed": 0, "paused": True}
+
+    assert km.get_or_create_container("s1") is container
+    container.unpause.assert_called_once()
+    container.start.assert_not_called()
+    assert km.active_kernels["s1"]["paused"] is False
+
+def test_cleanup_continues_when_one_stop_fails(km):
+    failing = StubContainer("c1", stop_side_effect=Exception("daemon error"))
+    healthy = StubContainer("c2")
+    km.active_kernels = {
+        "s1": {"container": failing, "last_accessed": time.time() - 4000},
+        "s2": {"container": healthy, "last_accessed": time.time() - 4000},
+    }
+
+    km.cleanup_sessions()
+
+    assert km.active_kernels == {}
+    failing.stop.assert_called_once_with(timeout=5)
+    healthy.stop.assert_called_once_with(timeout=5)
@@ -1,5 +1,4 @@
 from unittest.mock import patch
-from fastapi.testclient import TestClient
 import main
 
 def test_sanitize_id():
@@ -9,13 +8,17 @@ def test_sanitize_id():
     assert sanitize_id("session; drop table users") == "sessiondroptableusers"
     assert sanitize_id("id with spaces") == "idwithspaces"
     assert sanitize_id("") == ""
+    # Unicode letters and digits are kept, as with str.isalnum()
+    assert sanitize_id("セッション①/x") == "セッション①x"
 
-def test_path_traversal_blocked_upload():
+def test_path_traversal_blocked_upload(client):
     # Even with a mock kernel manager, we can check if it's called with sanitized ID
     with patch('main.kernel_manager') as mock_km:
         mock_km.resolve_session_id.side_effect = lambda x: x # Simple pass-through for mock
-
-        client = TestClient(main.app)
+        mock_km.nanoid_to_session = {}
+        mock_km.session_to_nanoid = {}
+        mock_km.file_id_map = {}
+        mock_km.file_name_to_id = {}
 
         # Malicious entity_id
         response = client.post(
@@ -29,31 +32,31 @@ def test_path_traversal_blocked_upload():
         # The ID passed to kernel_manager should be sanitized
         mock_km.resolve_session_id.assert_called_with("malicious")
 
-def test_path_traversal_blocked_download():
+def test_path_traversal_blocked_download(client, mocker, monkeypatch):
     # We patch RCE_DATA_DIR_INTERNAL to None to force the Docker fallback logic
     # which uses kernel_manager.download_file mock.
-    with patch('main.kernel_manager') as mock_km, \
-         patch('main.RCE_DATA_DIR_INTERNAL', None):
-        mock_km.nanoid_to_session = {}
-        mock_km.file_id_map = {}
-        mock_km.download_file.return_value = (b"content", 123456789)
-        mock_km.resolve_session_id.side_effect = lambda x: x
-
-        client = TestClient(main.app)
-
-        # Malicious session_id as query param to avoid path routing issues
-        response = client.get(
-            "/download",
-            params={"session_id": "../../etc", "filename": "test.txt"},
-            headers={"X-API-Key": main.API_KEY}
-        )
-
-        print(f"Response status: {response.status_code}")
-        if response.status_code != 200:
-            print(f"Response body: {response.text}")
-
-        assert response.status_code == 200
-
-        mock_km.download_file.assert_called()
-        args, _ = mock_km.download_file.call_args
-        assert args[0] == "etc"
+    mock_km = mocker.patch('main.kernel_manager')
+    monkeypatch.setattr(main, "RCE_DATA_DIR_INTERNAL", None)
+    mock_km.nanoid_to_session = {}
+    mock_km.file_id_map = {}
+    mock_km.file_name_to_id = {}
+    mock_km.download_file.return_value = (iter([b"content"]), 7, 123456789)
+    mock_km.resolve_session_id.side_effect = lambda x: x
+
+    # Malicious session_id as query param to avoid path routing issues
+    response = client.get(
+        "/download",
+        params={"session_id": "../../etc", "filename": "test.txt"},
+        headers={"X-API-Key": main.API_KEY}
+    )
+
+    print(f"Response status: {response.status_code}")
+    if response.status_code != 200:
+        print(f"Response body: {response.text}")
+
+    assert response.status_code == 200
+    assert response.content == b"content"
+
+    mock_km.download_file.assert_called()
+    args, _ = mock_km.download_file.call_args
+    assert args[0] == "etc"
@@ -1,12 +1,13 @@
 import pytest
-from fastapi.testclient import TestClient
 from unittest.mock import MagicMock, patch
 import os
 import io
 
-from main import app, API_KEY, kernel_manager
+from main import API_KEY, kernel_manager
 
-client = TestClient(app)
+def read_uploads(files):
+    """Reads the streamed (filename, file object) parts passed to upload_files."""
+    return [(name, f.read()) for name, f in files]
 
 @pytest.fixture(autouse=True)
 def reset_kernel_manager():
@@ -16,10 +17,12 @@ def reset_kernel_manager():
         kernel_manager.nanoid_to_session = {}
         kernel_manager.session_to_nanoid = {}
         kernel_manager.file_id_map = {}
+        kernel_manager.file_name_to_id = {}
     yield
 
-def test_upload_success_entity_id():
-    with patch.object(kernel_manager, 'upload_file') as mock_upload:
+def test_upload_success_entity_id(client):
+    received = []
+    with patch.object(kernel_manager, 'upload_files', side_effect=lambda sid, files: received.extend(read_uploads(files))) as mock_upload:
         # Pass multiple files with the same key "files"
         files = [
             ("files", ("test1.txt", b"content1")),
@@ -39,16 +42,17 @@ def test_upload_success_entity_id():
         assert data["files"][0]["filename"] == "test1.txt"
         assert data["files"][1]["filename"] == "test2.txt"
 
-        # Verify kernel_manager was called
-        assert mock_upload.call_count == 2
+        # Both files are uploaded in a single batch
+        mock_upload.assert_called_once()
+        assert received == [("test1.txt", b"content1"), ("test2.txt", b"content2")]
 
         # Check if session mapping was created
         nanoid_session = data["session_id"]
         with kernel_manager.lock:
             assert nanoid_session in kernel_manager.nanoid_to_session
 
-def test_upload_success_session_id_field():
-    with patch.object(kernel_manager, 'upload_file') as mock_upload:
+def test_upload_success_session_id_field(client):
+    with patch.object(kernel_manager, 'upload_files') as mock_upload:
         response = client.post(
             "/upload",
             headers={"X-API-Key": API_KEY},
@@ -64,8 +68,8 @@ def test_upload_success_session_id_field():
         assert data["filename"] == "file1.txt"
         mock_upload.assert_called_once()
 
-def test_upload_success_query_param():
-    with patch.object(kernel_manager, 'upload_file') as mock_upload:
+def test_upload_success_query_param(client):
+    with patch.object(kernel_manager, 'upload_files') as mock_upload:
         response = client.post(
             "/upload?session_id=query-session",
             headers={"X-API-Key": API_KEY},
@@ -75,8 +79,8 @@ def test_upload_success_query_param():
         assert response.status_code == 200
         assert response.json()["session_id"] == "query-session"
 
-def test_upload_no_session_id_generates_one():
-    with patch.object(kernel_manager, 'upload_file') as mock_upload:
+def test_upload_no_session_id_generates_one(client):
+    with patch.object(kernel_manager, 'upload_files') as mock_upload:
         response = client.post(
             "/upload",
             headers={"X-API-Key": API_KEY},
@@ -88,7 +92,7 @@ def test_upload_no_session_id_generates_one():
         assert "session_id" in data
         assert len(data["session_id"]) == 21 # Nanoid size
 
-def test_upload_no_files_fails():
+def test_upload_no_files_fails(client):
     response = client.post(
         "/upload",
         headers={"X-API-Key": API_KEY},
@@ -97,7 +101,7 @@ def test_upload_no_files_fails():
     assert response.status_code == 422
     assert "No files provided" in response.json()["detail"]
 
-def test_upload_unauthorized():
+def test_upload_unauthorized(client):
     response = client.post(
         "/upload",
         headers={"X-API-Key": "wrong-key"},
@@ -105,9 +109,10 @@ def test_upload_unauthorized():
     )
     assert response.status_code == 401
 
-def test_upload_priority_files_over_file():
+def test_upload_priority_files_over_file(client):
     # Tests that 'files' takes priority over 'file' if both are present
-    with patch.object(kernel_manager, 'upload_file') as mock_upload:
+    received = []
+    with patch.object(kernel_manager, 'upload_files', side_effect=lambda sid, files: received.extend(read_uploads(files))) as mock_upload:
         files = [
             ("files", ("f1.txt", b"c1")),
             ("file", ("f2.txt", b"c2"))
@@ -125,3 +130,4 @@ def test_upload_priority_files_over_file():
         assert len(response.json()["files"]) == 1
         assert response.json()["files"][0]["filename"] == "f1.txt"
         assert mock_upload.call_count == 1
+        assert received == [("f1.txt", b"c1")]
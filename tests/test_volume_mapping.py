@@ -1,18 +1,13 @@
 import pytest
 from unittest.mock import MagicMock, patch
-from fastapi.testclient import TestClient
 import os
-import shutil
-import tempfile
 import main
 
 @pytest.fixture
-def temp_data_dir():
-    d = tempfile.mkdtemp()
-    yield d
-    shutil.rmtree(d)
+def temp_data_dir(tmp_path):
+    return str(tmp_path)
 
-def test_upload_with_volume_mount(temp_data_dir):
+def test_upload_with_volume_mount(temp_data_dir, client):
     with patch('main.RCE_DATA_DIR_INTERNAL', temp_data_dir), \
          patch('main.RCE_DATA_DIR_HOST', temp_data_dir), \
          patch('main.DOCKER_CLIENT') as mock_docker:
@@ -21,7 +16,6 @@ def test_upload_with_volume_mount(temp_data_dir):
         mock_container = MagicMock()
         mock_docker.containers.run.return_value = mock_container
 
-        client = TestClient(main.app)
         session_id = "test-session-vol"
 
         response = client.post(
@@ -52,7 +46,7 @@ def test_upload_with_volume_mount(temp_data_dir):
         # The internal path for binding in kwargs["volumes"] should be temp_data_dir because we patched both
         assert kwargs["volumes"] == {os.path.join(temp_data_dir, internal_id): {'bind': '/mnt/data', 'mode': 'rw'}}
 
-def test_session_id_resolution_flow():
+def test_session_id_resolution_flow(client):
     with patch('main.kernel_manager') as mock_km:
         # Initial state: no mappings
         mock_km.nanoid_to_session = {}
@@ -68,8 +62,6 @@ def test_session_id_resolution_flow():
             mock_exec.return_value = {"stdout": "ok", "stderr": "", "exit_code": 0}
             mock_list.return_value = []
 
-            client = TestClient(main.app)
-
             # 1. First execution creates a mapping
             resp1 = client.post(
                 "/exec",
@@ -80,7 +72,7 @@ def test_session_id_resolution_flow():
             assert nanoid != "uuid-1"
             assert real_km.session_to_nanoid["uuid-1"] == nanoid
             assert real_km.nanoid_to_session[nanoid] == "uuid-1"
-            mock_exec.assert_called_with("uuid-1", "print(1)")
+            mock_exec.assert_called_with("uuid-1", "print(1)", output_format="text", list_files=True)
 
             # 2. Second execution using nanoid should resolve to uuid-1
             resp2 = client.post(
@@ -89,10 +81,14 @@ def test_session_id_resolution_flow():
                 json={"code": "print(2)", "session_id": nanoid}
             )
             assert resp2.json()["session_id"] == nanoid
-            mock_exec.assert_called_with("uuid-1", "print(2)")
+            mock_exec.assert_called_with("uuid-1", "print(2)", output_format="text", list_files=True)
 
             # 3. Upload using nanoid should resolve to uuid-1
-            with patch.object(real_km, 'upload_file') as mock_upload:
+            received = []
+            def record_upload(sid, files):
+                received.append((sid, [(name, f.read()) for name, f in files]))
+
+            with patch.object(real_km, 'upload_files', side_effect=record_upload) as mock_upload:
                 resp3 = client.post(
                     "/upload",
                     headers={"X-API-Key": main.API_KEY},
@@ -100,4 +96,5 @@ def test_session_id_resolution_flow():
                     files={"files": ("file.txt", b"data")}
                 )
                 assert resp3.status_code == 200
-                mock_upload.assert_called_once_with("uuid-1", "file.txt", b"data")
+                mock_upload.assert_called_once()
+                assert received == [("uuid-1", [("file.txt", b"data")])]
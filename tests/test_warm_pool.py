@@ -0,0 +1,162 @@
+import pytest
+from unittest.mock import MagicMock, patch
+import main
+from main import KernelManager
+
+pytestmark = pytest.mark.usefixtures("mock_docker_client")
+
+@pytest.fixture
+def km():
+    manager = KernelManager()
+    manager.active_kernels = {}
+    return manager
+
+def test_refill_pool_starts_containers(km, mock_docker_client):
+    with patch("main.RCE_WARM_POOL_SIZE", 3), patch("main.RCE_DATA_DIR_HOST", None):
+        km.refill_pool()
+
+    assert len(km.warm_pool) == 3
+    assert mock_docker_client.containers.run.call_count == 3
+    _, kwargs = mock_docker_client.containers.run.call_args
+    assert kwargs["labels"] == {"managed_by": main.RCE_MANAGED_BY_VALUE, "warm_pool": "1"}
+    assert kwargs["name"].startswith("rce_pool_")
+
+def test_start_new_container_uses_warm_pool(km, mock_docker_client):
+    warm_container = MagicMock()
+    km.warm_pool.append(("pool_abc", warm_container))
+
+    with patch("main.RCE_DATA_DIR_HOST", None):
+        container = km.start_new_container("session-1")
+
+    assert container is warm_container
+    assert km.active_kernels["session-1"]["container"] is warm_container
+    warm_container.rename.assert_called_once()
+    assert warm_container.rename.call_args.args[0].startswith("rce_session-1_")
+    mock_docker_client.containers.run.assert_not_called()
+
+def test_start_new_container_falls_back_when_pool_empty(km, mock_docker_client):
+    with patch("main.RCE_DATA_DIR_HOST", None):
+        km.start_new_container("session-2")
+
+    mock_docker_client.containers.run.assert_called_once()
+
+def test_warm_container_discarded_on_rename_failure(km, mock_docker_client):
+    broken = MagicMock()
+    broken.rename.side_effect = Exception("rename failed")
+    km.warm_pool.append(("pool_broken", broken))
+
+    with patch("main.RCE_DATA_DIR_HOST", None):
+        km.start_new_container("session-3")
+
+    broken.stop.assert_called_once()
+    mock_docker_client.containers.run.assert_called_once()
+
+def test_warm_pool_hands_over_volume_directory(km, tmp_path):
+    pool_dir = tmp_path / "pool_xyz"
+    pool_dir.mkdir()
+    warm_container = MagicMock()
+    km.warm_pool.append(("pool_xyz", warm_container))
+
+    with patch("main.RCE_DATA_DIR_HOST", str(tmp_path)), patch("main.RCE_DATA_DIR_INTERNAL", str(tmp_path)):
+        container = km.start_new_container("session-4")
+
+    assert container is warm_container
+    assert not pool_dir.exists()
+    assert (tmp_path / "session-4").is_dir()
+
+def test_warm_pool_skipped_when_session_dir_exists(km, mock_docker_client, tmp_path):
+    (tmp_path / "session-5").mkdir()
+    warm_container = MagicMock()
+    km.warm_pool.append(("pool_keep", warm_container))
+
+    with patch("main.RCE_DATA_DIR_HOST", str(tmp_path)), patch("main.RCE_DATA_DIR_INTERNAL", str(tmp_path)):
+        km.start_new_container("session-5")
+
+    # The pooled container stays available and the session gets a cold-started container
+    assert list(km.warm_pool) == [("pool_keep", warm_container)]
+    mock_docker_client.containers.run.assert_called_once()
+
+def test_recover_containers_handles_pool_containers(km, mock_docker_client):
+    idle = MagicMock()
+    idle.attrs = {
+        "Labels": {"managed_by": main.RCE_MANAGED_BY_VALUE, "warm_pool": "1"},
+        "Names": ["/rce_pool_123"],
+        "State": "running",
+    }
+
+    assigned = MagicMock()
+    assigned.attrs = {
+        "Labels": {"managed_by": main.RCE_MANAGED_BY_VALUE, "warm_pool": "1"},
+        "Names": ["/rce_user_42_abcdef"],
+        "State": "running",
+    }
+
+    mock_docker_client.containers.list.return_value = [idle, assigned]
+
+    with patch("main.RCE_WARM_POOL_SIZE", 2):
+        km.recover_containers()
+
+    assert list(km.warm_pool) == [("pool_123", idle)]
+    assert km.active_kernels["user_42"]["container"] is assigned
+
+def test_refill_pool_prestarts_python_worker(km, mock_docker_client):
+    worker = MagicMock()
+    with patch("main.RCE_WARM_POOL_SIZE", 1), patch("main.RCE_DATA_DIR_HOST", None), \
+         patch("main.RCE_PYTHON_WORKER", True), patch("main._PythonWorker", return_value=worker):
+        km.refill_pool()
+
+    _, container = km.warm_pool[0]
+    assert km.workers[container.id] is worker
+
+def test_paused_pool_is_unpaused_on_claim(km, mock_docker_client):
+    with patch("main.RCE_WARM_POOL_SIZE", 1), patch("main.RCE_DATA_DIR_HOST", None), \
+         patch("main.RCE_WARM_POOL_PAUSE", True):
+        km.refill_pool()
+        _, container = km.warm_pool[0]
+        container.pause.assert_called_once()
+
+        assert km.start_new_container("session-6") is container
+
+    container.unpause.assert_called_once()
+
+def test_recover_containers_applies_pause_setting(km, mock_docker_client):
+    paused = MagicMock()
+    paused.attrs = {
+        "Labels": {"managed_by": main.RCE_MANAGED_BY_VALUE, "warm_pool": "1"},
+        "Names": ["/rce_pool_paused"],
+        "State": "paused",
+    }
+    mock_docker_client.containers.list.return_value = [paused]
+
+    with patch("main.RCE_WARM_POOL_SIZE", 2), patch("main.RCE_WARM_POOL_PAUSE", False):
+        km.recover_containers()
+
+    paused.unpause.assert_called_once()
+    assert list(km.warm_pool) == [("pool_paused", paused)]
+
+def test_refill_pool_cleans_up_when_container_fails_to_start(km, mock_docker_client, tmp_path):
+    mock_docker_client.containers.run.side_effect = Exception("no such image")
+
+    with patch("main.RCE_WARM_POOL_SIZE", 1), \
+         patch("main.RCE_DATA_DIR_HOST", str(tmp_path)), patch("main.RCE_DATA_DIR_INTERNAL", str(tmp_path)):
+        with pytest.raises(Exception):
+            km.refill_pool()
+
+    assert list(tmp_path.iterdir()) == []
+    assert len(km.warm_pool) == 0
+
+def test_refill_pool_stops_container_when_pause_fails(km, mock_docker_client):
+    container = mock_docker_client.containers.run.return_value
+    container.pause.side_effect = Exception("pause failed")
+    worker = MagicMock()
+
+    with patch("main.RCE_WARM_POOL_SIZE", 1), patch("main.RCE_DATA_DIR_HOST", None), \
+         patch("main.RCE_WARM_POOL_PAUSE", True), patch("main.RCE_PYTHON_WORKER", True), \
+         patch("main._PythonWorker", return_value=worker):
+        with pytest.raises(Exception):
+            km.refill_pool()
+
+    container.stop.assert_called_once()
+    worker.close.assert_called_once()
+    assert km.workers == {}
+    assert len(km.warm_pool) == 0